@@ -0,0 +1,319 @@
+"""
+Benchmark ของ pipeline การแปลง DNG -> JPG โดยใช้ไฟล์ DNG สังเคราะห์ (ไม่ต้องดาวน์โหลดอะไร)
+
+วัด 3 แบบ:
+  - stage: เวลาของแต่ละขั้นตอนของไฟล์เดียว (อ่านไฟล์, decode raw, EXIF, resize, encode, เขียนไฟล์)
+    และขนาดไฟล์ที่ได้ ในทุกชุดของ ขนาดไฟล์ x MPX preset x คุณภาพ x รูปแบบไฟล์ปลายทาง
+  - batch: เวลาแปลงทั้งโฟลเดอร์ด้วย convert_dng_to_jpg ในแต่ละจำนวน worker
+  - resize: เวลาย่อขนาดของแต่ละโหมดใน RESIZE_MODES และความต่างจาก LANCZOS เต็ม (PSNR)
+
+ตัวอย่าง:
+    python benchmarks/bench_converter.py --output bench.json
+    python benchmarks/bench_converter.py --baseline bench.json --output bench_new.json
+
+ถ้าส่ง --baseline มา จะเปรียบเทียบกับผลครั้งก่อน และรายงานรายการที่ช้าลงเกิน --threshold
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import rawpy
+import PIL
+from PIL import Image
+
+import dng_converter
+from dng_converter import (MPX_OPTIONS, DEFAULT_WORKERS, DEFAULT_DECODE_MODE, DECODE_MODES, DEFAULT_RESIZE_MODE,
+                           RESIZE_MODES, DEFAULT_OUTPUT_FORMAT, OUTPUT_FORMATS, OUTPUT_FORMAT_BACKENDS, STAGES,
+                           calculate_new_dimensions, resize_image)
+from synthetic_dng import FIXTURE_SIZES, ensure_fixtures
+
+REPORT_VERSION = 1
+
+
+def time_stages(dng_path, output_folder, target_mpx_value, jpg_quality, decode_mode, resize_mode, output_format):
+    """
+    แปลงไฟล์เดียวด้วย convert_single_file แล้วคืนเวลาของแต่ละขั้นตอน dict {stage: วินาที} และขนาดไฟล์ที่ได้
+    (ขั้นตอนที่ไม่ได้ทำ เช่น decode ในโหมด preview จะเป็น 0)
+    """
+    extension = OUTPUT_FORMAT_BACKENDS[output_format].extension
+    jpg_path = os.path.join(output_folder, os.path.splitext(os.path.basename(dng_path))[0] + extension)
+    stats = dng_converter.convert_single_file(dng_path, jpg_path, target_mpx_value, jpg_quality, decode_mode,
+                                              resize_mode, output_format=output_format)
+    return {stage: stats["stages"].get(stage, 0.0) for stage in STAGES}, stats["bytes_written"]
+
+
+def run_stage_benchmarks(fixture_folders, work_folder, mpx_names, qualities, decode_mode, resize_mode, output_formats,
+                         repeat):
+    results = []
+    for size_name, folder in fixture_folders.items():
+        dng_path = os.path.join(folder, sorted(os.listdir(folder))[0])
+        for mpx_name in mpx_names:
+            for quality in qualities:
+                for output_format in output_formats:
+                    runs = [time_stages(dng_path, work_folder, MPX_OPTIONS[mpx_name], quality, decode_mode,
+                                        resize_mode, output_format) for _ in range(repeat)]
+                    # ใช้ค่ามัธยฐานของแต่ละ stage เพื่อลดผลของ noise
+                    stages = {stage: round(statistics.median(run[stage] for run, _ in runs), 6) for stage in STAGES}
+                    result = {
+                        "size": size_name,
+                        "mpx": mpx_name,
+                        "quality": quality,
+                        "decode_mode": decode_mode,
+                        "resize_mode": resize_mode,
+                        "output_format": output_format,
+                        "stages": stages,
+                        "total": round(sum(stages.values()), 6),
+                        "bytes_written": runs[0][1],
+                    }
+                    print(f"stage  {size_name:>5} {mpx_name:>8} q{quality:<3} {output_format:<16} "
+                          f"total {result['total']:.3f}s  {result['bytes_written']} bytes  "
+                          + "  ".join(f"{stage} {seconds:.3f}" for stage, seconds in stages.items()), flush=True)
+                    results.append(result)
+    return results
+
+
+def run_batch_benchmarks(fixture_folders, work_folder, mpx_names, quality, worker_counts, decode_mode, resize_mode,
+                         memory_budget_mb):
+    results = []
+    for size_name, folder in fixture_folders.items():
+        for mpx_name in mpx_names:
+            for workers in worker_counts:
+                output_folder = os.path.join(work_folder, f"batch_{size_name}_{workers}")
+                shutil.rmtree(output_folder, ignore_errors=True)
+                started = time.perf_counter()
+                summary = dng_converter.convert_dng_to_jpg(folder, output_folder, MPX_OPTIONS[mpx_name], quality,
+                                                           workers=workers, force=True, decode_mode=decode_mode,
+                                                           memory_budget_mb=memory_budget_mb, resize_mode=resize_mode)
+                seconds = time.perf_counter() - started
+                result = {
+                    "size": size_name,
+                    "mpx": mpx_name,
+                    "quality": quality,
+                    "decode_mode": decode_mode,
+                    "resize_mode": resize_mode,
+                    "workers": workers,
+                    "files": summary["converted"],
+                    "seconds": round(seconds, 6),
+                    "files_per_second": round(summary["converted"] / seconds, 3) if seconds else None,
+                    "peak_rss": summary["memory"]["peak_rss"],
+                }
+                print(f"batch  {size_name:>5} {mpx_name:>8} q{quality:<3} workers {workers:<3} "
+                      f"{result['files']} files in {seconds:.3f}s ({result['files_per_second']} files/s)", flush=True)
+                results.append(result)
+    return results
+
+
+def run_resize_benchmarks(fixture_folders, mpx_names, repeat):
+    """
+    decode ไฟล์แรกของแต่ละขนาดครั้งเดียว แล้ววัดเวลาย่อเป็นแต่ละ MPX preset ในทุกโหมดของ RESIZE_MODES
+    พร้อม PSNR (dB) เทียบกับผลของ LANCZOS เต็ม ("lanczos") ค่ายิ่งสูงยิ่งใกล้เคียง (inf = เหมือนกันทุกพิกเซล)
+    """
+    results = []
+    for size_name, folder in fixture_folders.items():
+        dng_path = os.path.join(folder, sorted(os.listdir(folder))[0])
+        with rawpy.imread(dng_path) as raw:
+            image = Image.fromarray(raw.postprocess(use_camera_wb=True, output_color=rawpy.ColorSpace.sRGB,
+                                                    no_auto_bright=True))
+        for mpx_name in mpx_names:
+            if MPX_OPTIONS[mpx_name] is None:
+                continue
+            size = calculate_new_dimensions(image.width, image.height, MPX_OPTIONS[mpx_name])
+            reference = np.asarray(resize_image(image, size, "lanczos"), dtype=np.float64)
+            for resize_mode in RESIZE_MODES.values():
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    resized = resize_image(image, size, resize_mode)
+                    timings.append(time.perf_counter() - started)
+                mse = float(np.mean((np.asarray(resized, dtype=np.float64) - reference) ** 2))
+                psnr = round(10 * np.log10(255 ** 2 / mse), 2) if mse else None # None = เหมือนกันทุกพิกเซล
+                result = {
+                    "size": size_name,
+                    "mpx": mpx_name,
+                    "resize_mode": resize_mode,
+                    "seconds": round(statistics.median(timings), 6),
+                    "psnr": psnr,
+                }
+                print(f"resize {size_name:>5} {mpx_name:>8} {resize_mode:<8} {result['seconds']:.3f}s  "
+                      f"PSNR {'inf' if psnr is None else f'{psnr:.1f}'} dB", flush=True)
+                results.append(result)
+    return results
+
+
+# รายงานก่อนมีโหมดการย่อขนาดใช้ LANCZOS เต็มเสมอ
+def _stage_key(result):
+    return ("stage", result["size"], result["mpx"], result["quality"], result["decode_mode"],
+            result.get("resize_mode", "lanczos"), result.get("output_format", "jpeg"))
+
+
+def _batch_key(result):
+    return ("batch", result["size"], result["mpx"], result["quality"], result["decode_mode"],
+            result.get("resize_mode", "lanczos"), result["workers"])
+
+
+def _resize_key(result):
+    return ("resize", result["size"], result["mpx"], result["resize_mode"])
+
+
+def compare_reports(report, baseline, threshold, min_delta=0.0):
+    """
+    เปรียบเทียบกับ baseline คืนค่า list ของทุกรายการที่วัดได้ทั้งสองครั้ง
+    รายการที่ช้าลงเกิน threshold (เช่น 0.1 = 10%) และช้าลงเกิน min_delta วินาที ถือว่าเป็น regression
+    (min_delta กันไม่ให้ขั้นตอนที่ใช้เวลาไม่ถึงมิลลิวินาทีถูกรายงานเพราะ noise)
+    รายการที่ไม่มีใน baseline จะถูกข้าม
+    """
+    measurements = {}
+    for result in baseline.get("stage_results", []):
+        for stage, seconds in result["stages"].items():
+            measurements[_stage_key(result) + (stage,)] = seconds
+        measurements[_stage_key(result) + ("total",)] = result["total"]
+    for result in baseline.get("batch_results", []):
+        measurements[_batch_key(result)] = result["seconds"]
+    for result in baseline.get("resize_results", []):
+        measurements[_resize_key(result)] = result["seconds"]
+
+    current = {}
+    for result in report["stage_results"]:
+        for stage, seconds in result["stages"].items():
+            current[_stage_key(result) + (stage,)] = seconds
+        current[_stage_key(result) + ("total",)] = result["total"]
+    for result in report["batch_results"]:
+        current[_batch_key(result)] = result["seconds"]
+    for result in report["resize_results"]:
+        current[_resize_key(result)] = result["seconds"]
+
+    comparisons = []
+    for key, seconds in current.items():
+        before = measurements.get(key)
+        if not before:
+            continue
+        change = (seconds - before) / before
+        comparisons.append({
+            "key": [str(part) for part in key],
+            "baseline_seconds": before,
+            "seconds": seconds,
+            "change": round(change, 4),
+            "regression": change > threshold and seconds - before > min_delta,
+        })
+    return comparisons
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the DNG to JPG pipeline on synthetic DNG files.")
+    parser.add_argument("--sizes", default="6mp,24mp",
+                        help=f"Comma separated fixture sizes from {', '.join(FIXTURE_SIZES)} (default: %(default)s)")
+    parser.add_argument("--mpx", default="Original,12 MPX,2 MPX",
+                        help="Comma separated MPX presets (default: %(default)s)")
+    parser.add_argument("--qualities", default="90,75", help="Comma separated JPG qualities (default: %(default)s)")
+    parser.add_argument("--workers", default=f"1,{DEFAULT_WORKERS}",
+                        help="Comma separated worker counts for the batch runs (default: %(default)s)")
+    parser.add_argument("--decode", default=DEFAULT_DECODE_MODE, choices=list(DECODE_MODES.values()),
+                        help="Raw decode mode (default: %(default)s)")
+    parser.add_argument("--resize", default=DEFAULT_RESIZE_MODE, choices=list(RESIZE_MODES.values()),
+                        help="Resize mode for the stage and batch runs (default: %(default)s)")
+    parser.add_argument("--formats", default=DEFAULT_OUTPUT_FORMAT,
+                        help=f"Comma separated output formats for the stage runs, from {', '.join(OUTPUT_FORMATS.values())} "
+                             "(default: %(default)s)")
+    parser.add_argument("--files", type=int, default=4, help="Files per size for the batch runs (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per stage measurement (default: %(default)s)")
+    parser.add_argument("--memory-budget", type=int, default=0, metavar="MB",
+                        help="Memory budget for the batch runs, 0 = no limit (default: %(default)s)")
+    parser.add_argument("--fixtures", help="Folder to keep generated fixtures in (default: a temporary folder)")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="Compare against a previous JSON report")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Slowdown ratio reported as a regression (default: %(default)s = 10%%)")
+    parser.add_argument("--min-delta", type=float, default=0.005, metavar="SECONDS",
+                        help="Ignore slowdowns smaller than this many seconds (default: %(default)s)")
+    parser.add_argument("--skip-batch", action="store_true", help="Don't run the batch measurements")
+    parser.add_argument("--skip-resize", action="store_true", help="Don't compare the resize modes")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    mpx_names = [name.strip() for name in args.mpx.split(",") if name.strip()]
+    qualities = [int(quality) for quality in args.qualities.split(",")]
+    worker_counts = [int(workers) for workers in args.workers.split(",")]
+    output_formats = [name.strip() for name in args.formats.split(",") if name.strip()]
+    for name in sizes:
+        if name not in FIXTURE_SIZES:
+            raise SystemExit(f"Unknown size {name!r}, choose from {', '.join(FIXTURE_SIZES)}")
+    for name in mpx_names:
+        if name not in MPX_OPTIONS:
+            raise SystemExit(f"Unknown MPX preset {name!r}, choose from {', '.join(MPX_OPTIONS)}")
+    for name in output_formats:
+        if name not in OUTPUT_FORMAT_BACKENDS:
+            raise SystemExit(f"Unknown output format {name!r}, choose from {', '.join(OUTPUT_FORMAT_BACKENDS)}")
+        if not OUTPUT_FORMAT_BACKENDS[name].is_available():
+            raise SystemExit(f"Output format {name!r} needs {OUTPUT_FORMAT_BACKENDS[name].requirement}")
+
+    work_folder = tempfile.mkdtemp(prefix="dng_bench_")
+    fixture_root = args.fixtures or os.path.join(work_folder, "fixtures")
+    try:
+        fixture_folders = {}
+        for size_name in sizes:
+            print(f"Preparing {args.files} synthetic {size_name} DNG files...", flush=True)
+            fixture_folders[size_name] = ensure_fixtures(fixture_root, size_name, max(1, args.files))
+
+        stage_results = run_stage_benchmarks(fixture_folders, work_folder, mpx_names, qualities,
+                                             args.decode, args.resize, output_formats, max(1, args.repeat))
+        batch_results = []
+        if not args.skip_batch:
+            batch_results = run_batch_benchmarks(fixture_folders, work_folder, mpx_names, qualities[0],
+                                                 worker_counts, args.decode, args.resize, args.memory_budget)
+        resize_results = []
+        if not args.skip_resize:
+            resize_results = run_resize_benchmarks(fixture_folders, mpx_names, max(1, args.repeat))
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    report = {
+        "version": REPORT_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "rawpy": rawpy.__version__,
+            "pillow": PIL.__version__,
+        },
+        "stage_results": stage_results,
+        "batch_results": batch_results,
+        "resize_results": resize_results,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        comparisons = compare_reports(report, baseline, args.threshold, args.min_delta)
+        report["comparison"] = {"baseline": args.baseline, "threshold": args.threshold, "results": comparisons}
+        regressions = [comparison for comparison in comparisons if comparison["regression"]]
+        for comparison in regressions:
+            print(f"REGRESSION {' / '.join(comparison['key'])}: {comparison['baseline_seconds']:.3f}s -> "
+                  f"{comparison['seconds']:.3f}s ({comparison['change']:+.1%})")
+        print(f"{len(comparisons)} measurements compared, {len(regressions)} regressions "
+              f"(threshold {args.threshold:.0%})")
+        exit_code = 1 if regressions else 0
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
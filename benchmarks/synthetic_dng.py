@@ -0,0 +1,178 @@
+"""
+สร้างไฟล์ DNG สังเคราะห์สำหรับ benchmark โดยไม่ต้องดาวน์โหลดไฟล์ตัวอย่าง
+
+ไฟล์ที่ได้เป็น DNG 1.4 แบบไม่บีบอัด: raw ขนาด 12-bit Bayer (RGGB) อยู่ใน SubIFD,
+IFD0 เก็บ JPEG preview และมี EXIF IFD พื้นฐาน เพื่อให้ทุกขั้นตอนของ pipeline
+(decode, EXIF, preview, resize, encode) ทำงานเหมือนกับไฟล์จากกล้องจริง
+"""
+import io
+import os
+import struct
+
+import numpy as np
+from PIL import Image
+
+# ขนาดเซนเซอร์ที่ใช้ใน benchmark (width, height)
+FIXTURE_SIZES = {
+    "6mp": (3000, 2000),
+    "24mp": (6000, 4000),
+    "45mp": (8256, 5504),
+}
+
+# TIFF field types
+BYTE, ASCII, SHORT, LONG, RATIONAL, SRATIONAL = 1, 2, 3, 4, 5, 10
+_STRUCT_FORMATS = {BYTE: 'B', ASCII: 'B', SHORT: 'H', LONG: 'I'}
+
+
+def _pack_values(field_type, values):
+    """แปลงค่าของ tag เป็น bytes (little-endian) คืนค่า (data, count)"""
+    if field_type == ASCII:
+        data = values.encode('ascii') + b'\0'
+        return data, len(data)
+    if field_type in (RATIONAL, SRATIONAL):
+        fmt = '<ii' if field_type == SRATIONAL else '<II'
+        return b''.join(struct.pack(fmt, num, den) for num, den in values), len(values)
+    fmt = '<' + _STRUCT_FORMATS[field_type]
+    return b''.join(struct.pack(fmt, value) for value in values), len(values)
+
+
+class _TiffWriter:
+    """เขียนไฟล์ TIFF แบบง่ายๆ: ต่อข้อมูลท้ายไฟล์ไปเรื่อยๆ แล้วคืน offset ให้ใช้อ้างอิงใน IFD"""
+
+    def __init__(self):
+        self.buffer = bytearray(b'II*\0\0\0\0\0')
+
+    def _align(self):
+        if len(self.buffer) % 2:
+            self.buffer += b'\0'
+
+    def add_blob(self, data):
+        self._align()
+        offset = len(self.buffer)
+        self.buffer += data
+        return offset
+
+    def add_ifd(self, entries):
+        """entries เป็น list ของ (tag, type, values) คืนค่า offset ของ IFD"""
+        entries = sorted(entries, key=lambda entry: entry[0])
+        self._align()
+        offset = len(self.buffer)
+        size = 2 + 12 * len(entries) + 4
+        self.buffer += b'\0' * size
+
+        ifd = struct.pack('<H', len(entries))
+        for tag, field_type, values in entries:
+            data, count = _pack_values(field_type, values)
+            if len(data) <= 4:
+                ifd += struct.pack('<HHI', tag, field_type, count) + data.ljust(4, b'\0')
+            else:
+                ifd += struct.pack('<HHII', tag, field_type, count, self.add_blob(data))
+        ifd += struct.pack('<I', 0) # ไม่มี IFD ถัดไป
+        self.buffer[offset:offset + size] = ifd
+        return offset
+
+    def set_first_ifd(self, offset):
+        self.buffer[4:8] = struct.pack('<I', offset)
+
+
+def make_bayer_data(width, height, seed=0):
+    """สร้างข้อมูล Bayer 12-bit ที่มี gradient + noise (ให้ JPEG encoder มีรายละเอียดให้บีบอัด)"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 3000, width, dtype=np.float32)
+    y = np.linspace(0, 1000, height, dtype=np.float32)
+    gradient = (x[np.newaxis, :] + y[:, np.newaxis]).astype(np.uint16)
+    noise = rng.integers(0, 256, size=(height, width), dtype=np.uint16)
+    return (gradient + noise) & 0x0FFF
+
+
+def write_synthetic_dng(path, width, height, preview_size=(1024, 683), seed=0):
+    """
+    เขียนไฟล์ DNG สังเคราะห์ขนาด width x height ไปที่ path
+    preview_size=None จะไม่ฝัง JPEG preview
+    """
+    bayer = make_bayer_data(width, height, seed)
+    tiff = _TiffWriter()
+
+    raw_offset = tiff.add_blob(bayer.astype('<u2').tobytes())
+    exif_ifd = tiff.add_ifd([
+        (0x829A, RATIONAL, [(1, 125)]),                # ExposureTime
+        (0x829D, RATIONAL, [(28, 10)]),                # FNumber
+        (0x8827, SHORT, [200]),                        # ISOSpeedRatings
+        (0x9003, ASCII, '2025:01:02 03:04:05'),        # DateTimeOriginal
+        (0x920A, RATIONAL, [(350, 10)]),               # FocalLength
+    ])
+    raw_ifd = tiff.add_ifd([
+        (254, LONG, [0]),                              # NewSubFileType: main image
+        (256, LONG, [width]),
+        (257, LONG, [height]),
+        (258, SHORT, [16]),                            # BitsPerSample
+        (259, SHORT, [1]),                             # Compression: none
+        (262, SHORT, [32803]),                         # PhotometricInterpretation: CFA
+        (273, LONG, [raw_offset]),                     # StripOffsets
+        (277, SHORT, [1]),                             # SamplesPerPixel
+        (278, LONG, [height]),                         # RowsPerStrip
+        (279, LONG, [width * height * 2]),             # StripByteCounts
+        (284, SHORT, [1]),                             # PlanarConfiguration
+        (33421, SHORT, [2, 2]),                        # CFARepeatPatternDim
+        (33422, BYTE, [0, 1, 1, 2]),                   # CFAPattern: RGGB
+        (50714, SHORT, [0]),                           # BlackLevel
+        (50717, SHORT, [4095]),                        # WhiteLevel
+    ])
+
+    ifd0 = [
+        (271, ASCII, 'Synthetic'),                     # Make
+        (272, ASCII, 'Benchmark Camera'),              # Model
+        (274, SHORT, [1]),                             # Orientation
+        (305, ASCII, 'dng_converter benchmark'),       # Software
+        (330, LONG, [raw_ifd]),                        # SubIFDs
+        (34665, LONG, [exif_ifd]),                     # ExifIFD
+        (50706, BYTE, [1, 4, 0, 0]),                   # DNGVersion
+        (50707, BYTE, [1, 1, 0, 0]),                   # DNGBackwardVersion
+        (50708, ASCII, 'Synthetic Benchmark Camera'),  # UniqueCameraModel
+        (50721, SRATIONAL, [(10000, 10000), (0, 10000), (0, 10000),
+                            (0, 10000), (10000, 10000), (0, 10000),
+                            (0, 10000), (0, 10000), (10000, 10000)]), # ColorMatrix1
+        (50728, RATIONAL, [(1, 2), (1, 1), (2, 3)]),   # AsShotNeutral
+        (50778, SHORT, [21]),                          # CalibrationIlluminant1: D65
+    ]
+    if preview_size:
+        preview_width, preview_height = preview_size
+        preview = Image.fromarray((bayer >> 4).astype(np.uint8)).convert('RGB')
+        preview = preview.resize((preview_width, preview_height), Image.BILINEAR)
+        jpeg = io.BytesIO()
+        preview.save(jpeg, format='JPEG', quality=90)
+        jpeg_bytes = jpeg.getvalue()
+        ifd0 += [
+            (254, LONG, [1]),                          # NewSubFileType: preview
+            (256, LONG, [preview_width]),
+            (257, LONG, [preview_height]),
+            (258, SHORT, [8, 8, 8]),
+            (259, SHORT, [7]),                         # Compression: JPEG
+            (262, SHORT, [6]),                         # PhotometricInterpretation: YCbCr
+            (273, LONG, [tiff.add_blob(jpeg_bytes)]),
+            (277, SHORT, [3]),
+            (278, LONG, [preview_height]),
+            (279, LONG, [len(jpeg_bytes)]),
+        ]
+    else:
+        ifd0 += [(254, LONG, [1]), (256, LONG, [1]), (257, LONG, [1]), (258, SHORT, [8])]
+
+    tiff.set_first_ifd(tiff.add_ifd(ifd0))
+    with open(path, 'wb') as f:
+        f.write(tiff.buffer)
+    return path
+
+
+def ensure_fixtures(folder, size_name, count):
+    """
+    สร้างไฟล์ fixture ขนาด size_name จำนวน count ไฟล์ใน folder/size_name (ถ้ายังไม่มี)
+    คืนค่า path ของโฟลเดอร์
+    """
+    width, height = FIXTURE_SIZES[size_name]
+    size_folder = os.path.join(folder, size_name)
+    os.makedirs(size_folder, exist_ok=True)
+    for index in range(count):
+        path = os.path.join(size_folder, f"synthetic_{size_name}_{index:03d}.dng")
+        if not os.path.exists(path):
+            write_synthetic_dng(path, width, height, seed=index)
+    return size_folder
@@ -0,0 +1,1808 @@
+"""
+DNG to JPG conversion pipeline.
+
+โมดูลนี้ไม่ import tkinter จึงใช้ได้ทั้งจาก GUI (dng_converter_gui.py),
+command line (dng_converter_cli.py) และจากสคริปต์อื่นๆ ที่ต้องการแปลงไฟล์แบบ headless
+"""
+import os
+import io
+import sys
+import select
+import signal
+import struct
+import csv
+import time
+import math
+import json
+import hashlib
+import logging
+import contextlib
+import queue
+import threading
+import multiprocessing
+import concurrent.futures
+import functools
+import rawpy
+from PIL import Image, features
+import piexif
+import exifread
+
+logger = logging.getLogger(__name__)
+
+# กำหนดค่า MPX ที่เลือกได้
+MPX_OPTIONS = {
+    "Original": None, # ใช้ None เพื่อระบุว่าให้คงขนาดเดิม
+    "2 MPX": 2_000_000,
+    "4 MPX": 4_000_000,
+    "6 MPX": 6_000_000,
+    "8 MPX": 8_000_000,
+    "10 MPX": 10_000_000,
+    "12 MPX": 12_000_000,
+    "14 MPX": 14_000_000,
+    "16 MPX": 16_000_000
+}
+
+# จำนวน worker process เริ่มต้น = จำนวน core ของเครื่อง
+DEFAULT_WORKERS = os.cpu_count() or 1
+# OMP_NUM_THREADS ที่ผู้ใช้ตั้งไว้เอง (ถ้ามี) จะใช้ค่านี้กับ worker แทนการแบ่ง core อัตโนมัติ
+USER_OMP_THREADS = os.environ.get("OMP_NUM_THREADS")
+
+# Manifest ในโฟลเดอร์ปลายทาง ใช้จำว่าไฟล์ไหนแปลงแล้วด้วยค่าตั้งอะไร เพื่อให้รันซ้ำแล้วข้ามไฟล์ที่ไม่เปลี่ยน
+MANIFEST_FILENAME = ".dng_converter_manifest.json"
+# version 2 เก็บค่าตั้งแต่ละชุดครั้งเดียวใน "settings" แล้วให้แต่ละไฟล์อ้างถึงด้วย hash (version 1 ยังอ่านได้)
+MANIFEST_VERSION = 2
+# บันทึก manifest ระหว่างรันอย่างมากทุกๆ กี่วินาที (ไม่ใช่ทุก N ไฟล์ เพราะเวลาเขียนเพิ่มตามจำนวนไฟล์ใน manifest)
+MANIFEST_SAVE_SECONDS = 30.0
+
+# โฟลเดอร์ (ในโฟลเดอร์ปลายทาง) ที่ GUI ใช้เก็บ log ผลการวัดของแต่ละรอบ
+STATS_LOG_FOLDER = ".dng_converter_logs"
+
+# โหมดการ decode ไฟล์ raw (คุณภาพ vs ความเร็ว)
+DECODE_MODES = {
+    "Full quality": "full", # demosaic เต็มความละเอียดเสมอ
+    "Auto": "auto",         # ใช้ half-size decode เมื่อขนาดที่ต้องการเล็กกว่า 1/4 ของเซนเซอร์
+    "Fastest": "fast",      # เหมือน Auto และใช้ demosaic แบบ LINEAR เมื่อต้อง decode เต็มขนาด
+    "Embedded preview": "preview", # ใช้ภาพ preview ที่ฝังมาในไฟล์ ถ้าไม่มีหรือเล็กเกินไปจะ decode แบบ Auto
+}
+DEFAULT_DECODE_MODE = "auto"
+
+# half_size ของ LibRaw ให้ภาพกว้าง/สูงครึ่งหนึ่ง (1/4 ของพื้นที่) จึงใช้ได้เมื่อเป้าหมายไม่เกินสัดส่วนนี้
+HALF_SIZE_MAX_AREA_RATIO = 0.25
+
+# preview ที่ฝังมาต้องมีจำนวนพิกเซลอย่างน้อยเท่านี้ของขนาดที่ต้องการ ถึงจะนำมาใช้แทนการ decode
+PREVIEW_MIN_AREA_RATIO = 0.8
+
+# โหมดการย่อขนาด (คุณภาพ vs ความเร็ว) ชื่อที่แสดงบน GUI -> ค่าที่ใช้ในโค้ด
+RESIZE_MODES = {
+    "Best quality": "lanczos", # LANCZOS ทั้งภาพ (แบบเดิม)
+    "Balanced": "balanced",    # ย่อแบบ box เป็นจำนวนเต็มเท่าก่อน แล้ว LANCZOS ช่วงสุดท้าย
+    "Fastest": "fast",         # เหมือน Balanced แต่ย่อแบบ box มากขึ้น
+}
+DEFAULT_RESIZE_MODE = "balanced"
+# reducing_gap ของ Image.resize ในแต่ละโหมด: Pillow จะ reduce() (box filter) ด้วยตัวคูณจำนวนเต็ม
+# ให้เหลือขนาดอย่างน้อย reducing_gap เท่าของขนาดปลายทาง แล้วจึง LANCZOS ส่วนที่เหลือ
+# (None = ไม่ reduce ก่อน) ค่าที่ต่ำลงเร็วขึ้นแต่ต่างจาก LANCZOS เต็มมากขึ้น
+# วัดด้วย benchmarks/bench_converter.py (resize_results): ภาพ 45 MP -> 2 MP เทียบกับ LANCZOS เต็ม
+# Balanced เร็วขึ้น ~2.4 เท่า (PSNR ~47 dB), Fastest เร็วขึ้น ~4.4 เท่า (PSNR ~40 dB)
+RESIZE_REDUCING_GAP = {"lanczos": None, "balanced": 2.0, "fast": 1.5}
+
+# รูปแบบไฟล์ปลายทาง ชื่อที่แสดงบน GUI -> ค่าที่ใช้ในโค้ด (ตัว encode อยู่ใน OUTPUT_FORMAT_BACKENDS)
+OUTPUT_FORMATS = {
+    "JPEG": "jpeg",                           # baseline JPEG (แบบเดิม)
+    "JPEG (progressive)": "jpeg_progressive", # progressive + optimize: ภาพเหมือน baseline แต่ไฟล์เล็กกว่า
+    "WebP": "webp",
+    "HEIF": "heif",                           # ต้องมี pillow_heif
+    "AVIF": "avif",                           # ต้องมี Pillow ที่ build พร้อม libavif หรือ pillow-avif-plugin
+}
+DEFAULT_OUTPUT_FORMAT = "jpeg"
+# chroma subsampling ที่เลือกได้ (4:4:4 = ไม่ลดความละเอียดของสี แบบเดิม) WebP แบบ lossy เป็น 4:2:0 เสมอ
+CHROMA_SUBSAMPLINGS = ("4:4:4", "4:2:2", "4:2:0")
+DEFAULT_SUBSAMPLING = "4:4:4"
+# แปลงคุณภาพ 1-100 ของผู้ใช้ (สเกลของ JPEG 4:4:4) เป็น quality ของแต่ละ encoder ให้ได้ SSIM ใกล้เคียงกัน
+# จุด (คุณภาพ JPEG, quality ของ encoder) ค่าระหว่างจุดใช้ linear interpolation ส่วนปลาย 1 และ 100 ตรึงไว้ที่ค่าเดิม
+# วัดจากภาพตัวอย่างของ scikit-image (astronaut, chelsea, coffee, rocket) ที่ JPEG 50/70/80/90
+# ที่ SSIM เท่ากัน WebP เล็กกว่า JPEG ~10-40%, AVIF และ HEIF เล็กกว่า ~40-55%
+OUTPUT_QUALITY_POINTS = {
+    "webp": ((1, 1), (50, 51), (70, 74), (80, 84), (90, 95), (100, 100)),
+    "heif": ((1, 1), (50, 35), (70, 41), (80, 47), (90, 57), (100, 100)),
+    "avif": ((1, 1), (50, 45), (70, 53), (80, 63), (90, 83), (100, 100)),
+}
+
+# หน่วยของขนาดไฟล์ปลายทางสูงสุด (parse_file_size) ใช้หน่วยฐาน 10 แบบเดียวกับระบบที่จำกัดขนาดไฟล์อัปโหลด
+FILE_SIZE_UNITS = {"b": 1, "kb": 1000, "mb": 1000 ** 2, "gb": 1000 ** 3}
+
+# นามสกุลไฟล์ที่ค้นหาในโฟลเดอร์ต้นฉบับ (เริ่มต้นเฉพาะ DNG)
+DEFAULT_EXTENSIONS = (".dng",)
+# นามสกุลไฟล์ raw อื่นๆ ที่ LibRaw (rawpy) อ่านได้
+SUPPORTED_RAW_EXTENSIONS = (".dng", ".cr2", ".cr3", ".crw", ".nef", ".nrw", ".arw", ".srf", ".sr2", ".raf", ".orf",
+                            ".rw2", ".rwl", ".pef", ".srw", ".x3f", ".3fr", ".fff", ".iiq", ".mos", ".mrw", ".erf",
+                            ".kdc", ".dcr")
+# ระยะเวลา (วินาที) ที่รอไฟล์ถัดไปจาก scanner ก่อนกลับไปตรวจงานที่เสร็จแล้ว
+SCAN_POLL_INTERVAL = 0.2
+
+# โหมดเฝ้าโฟลเดอร์ (watch): ไฟล์ใหม่จะถูกแปลงเมื่อขนาดและเวลาแก้ไขไม่เปลี่ยนนานเท่านี้ (วินาที)
+# เพื่อข้ามไฟล์ raw ที่ยังคัดลอก/เขียนจากกล้องไม่เสร็จ
+WATCH_SETTLE_SECONDS = 1.0
+# ระยะเวลาระหว่างการตรวจขนาดไฟล์ที่รอให้นิ่ง (และการรอ event ของ inotify แต่ละครั้ง)
+WATCH_POLL_INTERVAL = 0.25
+# ถ้าใช้ inotify ไม่ได้ (ไม่ใช่ Linux) จะสแกนโฟลเดอร์ทั้งหมดใหม่ทุกๆ กี่วินาที
+WATCH_RESCAN_INTERVAL = 2.0
+
+# ขั้นตอนของการแปลงไฟล์ที่ถูกจับเวลา (ConversionStats)
+STAGES = ("read", "decode", "exif", "resize", "encode", "write")
+
+# งบหน่วยความจำเริ่มต้นสำหรับไฟล์ที่กำลังแปลงพร้อมกันทั้งหมด (MB), 0 = ไม่จำกัด
+DEFAULT_MEMORY_BUDGET_MB = 4096
+# หน่วยความจำของ worker process หนึ่งตัวก่อนเริ่มแปลง (Python + numpy + rawpy + Pillow)
+WORKER_BASE_MEMORY = 80 * 1024 * 1024
+
+# Dictionary to map exifread tag names to piexif tag IDs and their IFD
+# This is a partial mapping, you might need to extend it for all possible tags
+# that exifread can find and you want to preserve.
+# For complex tags like GPS, we will handle them specifically.
+EXIFREAD_TO_PIEXIF_MAP = {
+    # 0th IFD (Image IFD)
+    'Image Make': (piexif.ImageIFD.Make, 'bytes'),
+    'Image Model': (piexif.ImageIFD.Model, 'bytes'),
+    'Image Orientation': (piexif.ImageIFD.Orientation, 'int'),
+    'Image Artist': (piexif.ImageIFD.Artist, 'bytes'),
+    'Image Copyright': (piexif.ImageIFD.Copyright, 'bytes'),
+    'Image Software': (piexif.ImageIFD.Software, 'bytes'),
+    'Image DateTime': (piexif.ImageIFD.DateTime, 'bytes'), # Date and time of image creation
+
+    # Exif IFD
+    'EXIF ExposureTime': (piexif.ExifIFD.ExposureTime, 'rational'),
+    'EXIF FNumber': (piexif.ExifIFD.FNumber, 'rational'),
+    'EXIF ExposureProgram': (piexif.ExifIFD.ExposureProgram, 'int'),
+    'EXIF ISOSpeedRatings': (piexif.ExifIFD.ISOSpeedRatings, 'int'),
+    'EXIF SensitivityType': (piexif.ExifIFD.SensitivityType, 'int'), # Added from your image
+    'EXIF RecommendedExposureIndex': (piexif.ExifIFD.RecommendedExposureIndex, 'long'), # Added
+    'EXIF ExifVersion': (piexif.ExifIFD.ExifVersion, 'bytes'), # Added
+    'EXIF DateTimeOriginal': (piexif.ExifIFD.DateTimeOriginal, 'bytes'),
+    'EXIF DateTimeDigitized': (piexif.ExifIFD.DateTimeDigitized, 'bytes'),
+    'EXIF ShutterSpeedValue': (piexif.ExifIFD.ShutterSpeedValue, 's_rational'), # Signed Rational
+    'EXIF ApertureValue': (piexif.ExifIFD.ApertureValue, 'rational'),
+    'EXIF ExposureBiasValue': (piexif.ExifIFD.ExposureBiasValue, 's_rational'), # Signed Rational
+    'EXIF MaxApertureValue': (piexif.ExifIFD.MaxApertureValue, 'rational'),
+    'EXIF MeteringMode': (piexif.ExifIFD.MeteringMode, 'int'),
+    'EXIF Flash': (piexif.ExifIFD.Flash, 'int'),
+    'EXIF FocalLength': (piexif.ExifIFD.FocalLength, 'rational'),
+    'EXIF SubSecTimeOriginal': (piexif.ExifIFD.SubSecTimeOriginal, 'bytes'), # Added
+    'EXIF SubSecTimeDigitized': (piexif.ExifIFD.SubSecTimeDigitized, 'bytes'), # Added
+    'EXIF ColorSpace': (piexif.ExifIFD.ColorSpace, 'int'), # Added
+    'EXIF FocalPlaneXResolution': (piexif.ExifIFD.FocalPlaneXResolution, 'rational'), # Added
+    'EXIF FocalPlaneYResolution': (piexif.ExifIFD.FocalPlaneYResolution, 'rational'), # Added
+    'EXIF FocalPlaneResolutionUnit': (piexif.ExifIFD.FocalPlaneResolutionUnit, 'int'), # Added
+    'EXIF CustomRendered': (piexif.ExifIFD.CustomRendered, 'int'), # Added
+    'EXIF ExposureMode': (piexif.ExifIFD.ExposureMode, 'int'), # Added
+    'EXIF WhiteBalance': (piexif.ExifIFD.WhiteBalance, 'int'), # Added (note: also in 0th sometimes)
+    'EXIF SceneCaptureType': (piexif.ExifIFD.SceneCaptureType, 'int'), # Added
+    'EXIF BodySerialNumber': (piexif.ExifIFD.BodySerialNumber, 'bytes'), # Added
+    'EXIF LensSpecification': (piexif.ExifIFD.LensSpecification, 'rational_list'), # Added, this is a list of rationals
+    'EXIF LensModel': (piexif.ExifIFD.LensModel, 'bytes'), # Added
+    'EXIF LensSerialNumber': (piexif.ExifIFD.LensSerialNumber, 'bytes'), # Added
+    'EXIF ComponentsConfiguration': (piexif.ExifIFD.ComponentsConfiguration, 'bytes'),
+    'EXIF FlashpixVersion': (piexif.ExifIFD.FlashpixVersion, 'bytes'),
+    'EXIF PixelXDimension': (piexif.ExifIFD.PixelXDimension, 'int'),
+    'EXIF PixelYDimension': (piexif.ExifIFD.PixelYDimension, 'int'),
+    'EXIF SceneType': (piexif.ExifIFD.SceneType, 'bytes'), # Undefined type often maps to bytes
+    'EXIF DigitalZoomRatio': (piexif.ExifIFD.DigitalZoomRatio, 'rational'),
+    'EXIF FNumber': (piexif.ExifIFD.FNumber, 'rational'),
+    # ... add more EXIF tags as needed from your exifread output
+}
+
+# Mapping for GPS tags (GPSIFD)
+GPS_TAGS_MAP = {
+    'GPS GPSVersionID': (piexif.GPSIFD.GPSVersionID, 'bytes_list'), # list of bytes (4 bytes)
+    'GPS GPSLatitudeRef': (piexif.GPSIFD.GPSLatitudeRef, 'bytes'),
+    'GPS GPSLatitude': (piexif.GPSIFD.GPSLatitude, 'rational_list'),
+    'GPS GPSLongitudeRef': (piexif.GPSIFD.GPSLongitudeRef, 'bytes'),
+    'GPS GPSLongitude': (piexif.GPSIFD.GPSLongitude, 'rational_list'),
+    'GPS GPSAltitudeRef': (piexif.GPSIFD.GPSAltitudeRef, 'int'),
+    'GPS GPSAltitude': (piexif.GPSIFD.GPSAltitude, 'rational'),
+    'GPS GPSTimeStamp': (piexif.GPSIFD.GPSTimeStamp, 'rational_list'),
+    'GPS GPSDate': (piexif.GPSIFD.GPSDateStamp, 'bytes'),
+    'GPS GPSStatus': (piexif.GPSIFD.GPSStatus, 'bytes'),
+    'GPS GPSMeasureMode': (piexif.GPSIFD.GPSMeasureMode, 'bytes'),
+    'GPS GPSSpeedRef': (piexif.GPSIFD.GPSSpeedRef, 'bytes'),
+    'GPS GPSSpeed': (piexif.GPSIFD.GPSSpeed, 'rational'),
+    'GPS GPSTrackRef': (piexif.GPSIFD.GPSTrackRef, 'bytes'),
+    'GPS GPSTrack': (piexif.GPSIFD.GPSTrack, 'rational'),
+    'GPS GPSImgDirectionRef': (piexif.GPSIFD.GPSImgDirectionRef, 'bytes'),
+    'GPS GPSImgDirection': (piexif.GPSIFD.GPSImgDirection, 'rational'),
+    'GPS GPSMapDatum': (piexif.GPSIFD.GPSMapDatum, 'bytes'),
+    'GPS GPSDestLatitudeRef': (piexif.GPSIFD.GPSDestLatitudeRef, 'bytes'),
+    'GPS GPSDestLatitude': (piexif.GPSIFD.GPSDestLatitude, 'rational_list'),
+    'GPS GPSDestLongitudeRef': (piexif.GPSIFD.GPSDestLongitudeRef, 'bytes'),
+    'GPS GPSDestLongitude': (piexif.GPSIFD.GPSDestLongitude, 'rational_list'),
+    'GPS GPSDestBearingRef': (piexif.GPSIFD.GPSDestBearingRef, 'bytes'),
+    'GPS GPSDestBearing': (piexif.GPSIFD.GPSDestBearing, 'rational'),
+    'GPS GPSDestDistanceRef': (piexif.GPSIFD.GPSDestDistanceRef, 'bytes'),
+    'GPS GPSDestDistance': (piexif.GPSIFD.GPSDestDistance, 'rational'),
+    # ... add more GPS tags
+}
+
+
+def get_piexif_ifd(exifread_tag_name):
+    """Determines which piexif IFD a tag belongs to based on its name."""
+    if exifread_tag_name.startswith('GPS'):
+        return "GPS"
+    elif exifread_tag_name.startswith('EXIF'):
+        return "Exif"
+    elif exifread_tag_name.startswith('Image'):
+        return "0th"
+    # You might need to add logic for "Interop" or "1st" IFD if necessary
+    return None # Unknown IFD
+
+
+def _first_rational(exifread_tag_obj):
+    val = exifread_tag_obj.values[0]
+    # exifread.Rational handles negative num/den itself. piexif also needs (num, den)
+    return (val.num, val.den)
+
+
+# Converters from exifread Tag objects to piexif values, keyed by the data types used in the maps above
+EXIF_VALUE_CONVERTERS = {
+    'bytes': lambda tag: str(tag).encode('utf-8'),
+    'int': lambda tag: tag.values[0],
+    'long': lambda tag: tag.values[0], # For Long type which exifread also gives as int
+    'rational': _first_rational,
+    's_rational': _first_rational, # Signed Rational
+    # For tags like GPS Latitude/Longitude, which are list of rationals
+    'rational_list': lambda tag: [(val.num, val.den) for val in tag.values],
+    # For GPSVersionID which is a list of bytes/ints
+    'bytes_list': lambda tag: tuple(tag.values),
+}
+
+
+def convert_exifread_value_to_piexif_format(exifread_tag_obj, data_type):
+    """
+    Converts exifread Tag object value to piexif compatible format.
+    Handles common data types.
+    """
+    if exifread_tag_obj is None:
+        return None
+
+    converter = EXIF_VALUE_CONVERTERS.get(data_type)
+    if converter is None:
+        return None # Return None for unsupported types
+    return converter(exifread_tag_obj)
+
+
+def build_exif_tag_lookup():
+    """
+    รวม EXIFREAD_TO_PIEXIF_MAP และ GPS_TAGS_MAP เป็นตารางเดียว
+    {ชื่อ tag ของ exifread: (IFD ของ piexif, tag ID, ฟังก์ชันแปลงค่า)} สร้างครั้งเดียวตอน import
+    """
+    lookup = {}
+    for tag_name, (piexif_id, data_type) in EXIFREAD_TO_PIEXIF_MAP.items():
+        ifd_name = get_piexif_ifd(tag_name)
+        if ifd_name is None:
+            logger.warning("Could not determine IFD for %s", tag_name)
+            continue
+        lookup[tag_name] = (ifd_name, piexif_id, EXIF_VALUE_CONVERTERS[data_type])
+    for tag_name, (piexif_id, data_type) in GPS_TAGS_MAP.items():
+        lookup[tag_name] = ("GPS", piexif_id, EXIF_VALUE_CONVERTERS[data_type])
+    return lookup
+
+
+EXIF_TAG_LOOKUP = build_exif_tag_lookup()
+
+
+def read_source_file(source_path):
+    """
+    อ่านไฟล์ต้นฉบับทั้งไฟล์ครั้งเดียว เพื่อใช้ทั้งกับ rawpy และ exifread
+    (ลดการอ่านซ้ำจาก network drive)
+    """
+    with open(source_path, 'rb') as f:
+        return f.read()
+
+
+def read_exif_bytes(source_path, data=None):
+    """
+    อ่านข้อมูล EXIF จากไฟล์ต้นฉบับ (DNG หรือ JPG) ด้วย exifread แล้วสร้างเป็น EXIF bytes ด้วย piexif
+    ถ้าส่ง data (เนื้อหาไฟล์ที่อ่านไว้แล้ว) มา จะไม่เปิดไฟล์ซ้ำ
+    ถ้าไม่ส่งมา exifread จะ seek อ่านเฉพาะส่วน header/IFD ของไฟล์
+    คืนค่า None ถ้าไม่มีข้อมูล EXIF ที่คัดลอกได้
+    """
+    exif_bytes_to_save = None
+    piexif_exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "Interop": {}, "1st": {}}
+
+    try:
+        # 1. อ่าน EXIF ด้วย exifread (ไม่อ่าน thumbnail และ MakerNote เพื่อให้อ่านเฉพาะ IFD)
+        if data is not None:
+            tags = exifread.process_file(io.BytesIO(data), details=False, extract_thumbnail=False)
+        else:
+            with open(source_path, 'rb') as f:
+                tags = exifread.process_file(f, details=False, extract_thumbnail=False)
+        
+        logger.debug("Successfully loaded EXIF with exifread from %s", source_path)
+        
+        # 2. แปลงเฉพาะ Tag ที่อยู่ในตาราง (tag อื่นถูกข้ามไป)
+        for tag_name, tag_obj in tags.items():
+            entry = EXIF_TAG_LOOKUP.get(tag_name)
+            if entry is None:
+                continue
+            ifd_name, piexif_id, converter = entry
+            converted_value = converter(tag_obj)
+            if converted_value is not None:
+                piexif_exif_dict[ifd_name][piexif_id] = converted_value
+
+        # 3. แปลง piexif_exif_dict กลับเป็น bytes เพื่อบันทึก
+        if any(piexif_exif_dict[ifd] for ifd in piexif_exif_dict):
+            # Clean up potentially empty IFDs before dumping, as piexif might complain
+            # (though piexif.dump usually handles empty IFDs gracefully if they are empty dicts)
+            
+            exif_bytes_to_save = piexif.dump(piexif_exif_dict)
+            logger.debug("EXIF data successfully dumped to bytes.")
+        else:
+            logger.debug("No relevant EXIF data found by exifread to copy or empty EXIF dict.")
+
+    except exifread.exceptions.InvalidExifError:
+        logger.info("No valid EXIF data found in %s using exifread.", source_path)
+    except Exception as e_read:
+        logger.warning("Error processing EXIF with exifread/piexif for %s: %s", source_path, e_read)
+
+    return exif_bytes_to_save
+
+
+def copy_exif_data(source_path, target_image, data=None):
+    """
+    คัดลอกข้อมูล EXIF ทั้งหมดจากไฟล์ต้นฉบับ (DNG หรือ JPG) ไปยังอ็อบเจกต์ Image ของ Pillow
+    โดยใช้ exifread ในการอ่าน และ piexif ในการสร้างและบันทึก
+    """
+    exif_bytes_to_save = read_exif_bytes(source_path, data)
+
+    # 4. กำหนด exif bytes ให้กับอ็อบเจกต์ Image ของ Pillow
+    if exif_bytes_to_save:
+        target_image.info['exif'] = exif_bytes_to_save
+        logger.debug("EXIF bytes assigned to target image for saving.")
+    else:
+        if 'exif' in target_image.info:
+            del target_image.info['exif']
+        logger.debug("No EXIF data will be copied for %s.", source_path)
+
+
+def calculate_new_dimensions(original_width, original_height, target_mpx):
+    """
+    คำนวณขนาดใหม่ (width, height) เพื่อให้ได้จำนวนพิกเซลใกล้เคียง target_mpx
+    โดยรักษาสัดส่วนภาพเดิม
+    """
+    if target_mpx is None: # Original size
+        return original_width, original_height
+
+    original_mpx = original_width * original_height
+    
+    if original_mpx <= target_mpx: # ถ้าภาพต้นฉบับเล็กกว่าหรือเท่ากับขนาดที่ต้องการ
+        return original_width, original_height # ไม่ต้องขยายภาพ
+
+    aspect_ratio = original_width / original_height
+    
+    # คำนวณความสูงใหม่จาก target_mpx และ aspect_ratio
+    new_height = int(math.sqrt(target_mpx / aspect_ratio))
+    new_width = int(new_height * aspect_ratio)
+
+    return new_width, new_height
+
+
+@contextlib.contextmanager
+def atomic_output_path(final_path):
+    """
+    ให้ path ชั่วคราวสำหรับเขียนไฟล์ แล้วค่อย rename ไปเป็น final_path เมื่อเขียนเสร็จ
+    ถ้าโปรแกรมหยุดกลางคันจะไม่มีไฟล์ที่เขียนไม่ครบเหลืออยู่ในชื่อจริง
+    """
+    folder, name = os.path.split(final_path)
+    temp_path = os.path.join(folder, f".{name}.part") # ชื่อคงที่ จึงถูกเขียนทับในรอบถัดไปถ้าค้างอยู่
+    try:
+        yield temp_path
+        os.replace(temp_path, final_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def source_fingerprint(source_path):
+    """ข้อมูลของไฟล์ต้นฉบับที่ใช้ตรวจว่าไฟล์เปลี่ยนไปหรือไม่ตั้งแต่แปลงครั้งก่อน"""
+    stat = os.stat(source_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_manifest(output_folder):
+    """
+    อ่าน manifest ของโฟลเดอร์ปลายทาง คืนค่าเป็น dict {ชื่อไฟล์ต้นฉบับ: entry}
+    entry["settings"] เป็น dict ของค่าตั้ง (entry ที่ใช้ค่าตั้งชุดเดียวกันใช้ dict เดียวกัน)
+    ถ้าไม่มีไฟล์ หรือไฟล์เสีย/เป็นเวอร์ชันอื่น จะคืน dict ว่าง (คือแปลงใหม่ทั้งหมด)
+    """
+    manifest_path = os.path.join(output_folder, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable manifest %s: %s", manifest_path, e)
+        return {}
+
+    if not isinstance(manifest, dict) or manifest.get("version") not in (1, MANIFEST_VERSION):
+        return {}
+    entries = manifest.get("files", {})
+    if manifest["version"] == MANIFEST_VERSION:
+        settings_table = manifest.get("settings", {})
+        for entry in entries.values():
+            entry["settings"] = settings_table.get(entry.get("settings"))
+    return entries
+
+
+def settings_key(settings):
+    """hash สั้นๆ ของค่าตั้งชุดหนึ่ง ใช้เป็น key ของตาราง "settings" ใน manifest"""
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def save_manifest(output_folder, entries):
+    """
+    บันทึก manifest แบบ atomic (เขียนไฟล์ชั่วคราวแล้ว rename)
+    ค่าตั้งแต่ละชุดถูกเขียนครั้งเดียวในตาราง "settings" และ JSON ไม่เว้นย่อหน้า เพื่อให้ไฟล์เล็กแม้มีหลายหมื่นไฟล์
+    """
+    settings_table = {}
+    keys = {} # id(settings) -> key: entry ส่วนใหญ่ใช้ dict เดียวกัน จึงคำนวณ hash ครั้งเดียวต่อชุด
+    files = {}
+    for name, entry in entries.items():
+        settings = entry.get("settings")
+        key = keys.get(id(settings))
+        if key is None:
+            key = keys[id(settings)] = settings_key(settings)
+            settings_table[key] = settings
+        files[name] = dict(entry, settings=key)
+
+    manifest_path = os.path.join(output_folder, MANIFEST_FILENAME)
+    with atomic_output_path(manifest_path) as temp_path:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": MANIFEST_VERSION, "settings": settings_table, "files": files}, f,
+                      sort_keys=True, separators=(',', ':'))
+
+
+def is_up_to_date(entry, fingerprint, settings, output_paths):
+    """ไฟล์ปลายทางยังใช้ได้หรือไม่: ต้นฉบับไม่เปลี่ยน, ตั้งค่าเหมือนเดิม และไฟล์ปลายทางทุกไฟล์ยังอยู่"""
+    if not entry:
+        return False
+    return (entry.get("size") == fingerprint["size"]
+            and entry.get("mtime_ns") == fingerprint["mtime_ns"]
+            and entry.get("settings") == settings
+            and all(os.path.exists(output_path) for output_path in output_paths))
+
+
+def get_output_dimensions(raw):
+    """ขนาด (width, height) ของภาพที่ postprocess เต็มขนาดจะให้ออกมา โดยคิดการหมุนภาพ (flip) ด้วย"""
+    sizes = raw.sizes
+    if sizes.flip in (5, 6): # หมุน 90 องศา
+        return sizes.height, sizes.width
+    return sizes.width, sizes.height
+
+
+def choose_postprocess_options(full_width, full_height, target_mpx_value, decode_mode):
+    """
+    เลือก option เพิ่มเติมของ raw.postprocess ตามโหมด decode
+    คืนค่า (options, half_size) โดย half_size บอกว่าภาพที่ได้จะเล็กลงครึ่งหนึ่งในแต่ละด้าน
+    """
+    if decode_mode == "full":
+        return {}, False
+
+    if target_mpx_value is not None:
+        new_width, new_height = calculate_new_dimensions(full_width, full_height, target_mpx_value)
+        if new_width * new_height <= full_width * full_height * HALF_SIZE_MAX_AREA_RATIO:
+            # ข้าม demosaic ไปเลย: LibRaw รวม 2x2 Bayer block เป็นหนึ่งพิกเซล
+            return {"half_size": True}, True
+
+    if decode_mode == "fast":
+        return {"demosaic_algorithm": rawpy.DemosaicAlgorithm.LINEAR}, False
+    return {}, False
+
+
+class ConversionStats:
+    """
+    ผลการวัดของการแปลงไฟล์หนึ่งไฟล์: เวลาของแต่ละขั้นตอน (STAGES), bytes ที่อ่าน/เขียน
+    และจำนวนพิกเซลก่อน/หลังย่อขนาด
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.pixels_in = 0
+        self.pixels_out = 0
+        self.source = "raw" # "raw" = decode ข้อมูล raw, "preview" = ใช้ preview ที่ฝังมา
+        self.qualities = {} # path ของไฟล์ปลายทาง -> คุณภาพ JPG ที่ใช้จริง (None = เขียน JPEG ของ preview เดิม)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def as_dict(self):
+        return {
+            "source": self.source,
+            "stages": {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "pixels_in": self.pixels_in,
+            "pixels_out": self.pixels_out,
+            "qualities": self.qualities,
+        }
+
+
+def write_output_bytes(jpg_path, data, stats):
+    """เขียน bytes ลงไฟล์ปลายทางแบบ atomic พร้อมจับเวลาขั้นตอน write"""
+    with stats.stage("write"):
+        with atomic_output_path(jpg_path) as temp_path:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+    stats.bytes_written += len(data)
+
+
+# --- Output formats ---
+
+def interpolate_quality(points, quality):
+    """แปลงคุณภาพ 1-100 ด้วยจุดใน OUTPUT_QUALITY_POINTS (linear interpolation ระหว่างจุด)"""
+    for (low, low_value), (high, high_value) in zip(points, points[1:]):
+        if quality <= high:
+            return round(low_value + (quality - low) * (high_value - low_value) / (high - low))
+    return points[-1][1]
+
+
+@functools.lru_cache(maxsize=None)
+def register_heif_plugin():
+    """ลงทะเบียน HEIF encoder ของ pillow_heif กับ Pillow (ครั้งเดียวต่อ process) คืน False ถ้าไม่ได้ติดตั้ง"""
+    try:
+        import pillow_heif
+    except ImportError:
+        return False
+    pillow_heif.register_heif_opener()
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def register_avif_plugin():
+    """ตรวจว่า Pillow encode AVIF ได้หรือไม่ ถ้าไม่ได้ลองใช้ pillow-avif-plugin แทน"""
+    if "avif" in features.modules and features.check_module("avif"): # Pillow >= 11.2 ที่ build พร้อม libavif
+        return True
+    try:
+        import pillow_avif # ลงทะเบียน plugin ตอน import
+    except ImportError:
+        return False
+    return True
+
+
+def _jpeg_options(quality, subsampling):
+    return {"quality": quality, "subsampling": subsampling}
+
+
+def _progressive_jpeg_options(quality, subsampling):
+    return {"quality": quality, "subsampling": subsampling, "progressive": True, "optimize": True}
+
+
+def _webp_options(quality, subsampling):
+    return {"quality": quality, "method": 4} # method 4 = ค่าเริ่มต้นของ libwebp (ความเร็ว vs ขนาดไฟล์)
+
+
+def _heif_options(quality, subsampling):
+    return {"quality": quality, "chroma": int(subsampling.replace(':', ''))} # เช่น "4:2:0" -> 420
+
+
+def _avif_options(quality, subsampling):
+    return {"quality": quality, "subsampling": subsampling, "speed": 6}
+
+
+class OutputFormat:
+    """
+    ตัว encode ไฟล์ปลายทางหนึ่งรูปแบบ
+    - save_options(quality, subsampling) คืน keyword arguments ของ Image.save สำหรับ format นี้
+    - quality_points แปลงคุณภาพ 1-100 ของผู้ใช้เป็น quality ของ encoder (None = ใช้ค่าเดิม)
+    - exif_header: EXIF ใน JPEG (APP1) ต้องขึ้นต้นด้วย "Exif" header ส่วน WebP/HEIF/AVIF เก็บเฉพาะข้อมูล TIFF
+    - plugin คือฟังก์ชันที่เตรียม encoder และคืน False ถ้าใช้ไม่ได้ในเครื่องนี้ (requirement คือสิ่งที่ต้องติดตั้ง)
+    """
+
+    def __init__(self, extension, pil_format, save_options, quality_points=None, exif_header=False, plugin=None,
+                 requirement=None):
+        self.extension = extension
+        self.pil_format = pil_format
+        self.save_options = save_options
+        self.quality_points = quality_points
+        self.exif_header = exif_header
+        self.plugin = plugin
+        self.requirement = requirement
+
+    def is_available(self):
+        return self.plugin is None or self.plugin()
+
+    def encoder_quality(self, quality):
+        return quality if self.quality_points is None else interpolate_quality(self.quality_points, quality)
+
+    def encode(self, image, quality, exif_bytes, subsampling=DEFAULT_SUBSAMPLING):
+        """encode ภาพในหน่วยความจำ คืนค่า BytesIO"""
+        if not self.is_available():
+            raise RuntimeError(f"{self.pil_format} output needs {self.requirement}")
+        exif = exif_bytes or b''
+        if not self.exif_header and exif.startswith(b'Exif\x00\x00'):
+            exif = exif[6:]
+        output = io.BytesIO()
+        image.save(output, format=self.pil_format, exif=exif,
+                   **self.save_options(self.encoder_quality(quality), subsampling))
+        return output
+
+
+OUTPUT_FORMAT_BACKENDS = {
+    "jpeg": OutputFormat(".jpg", "JPEG", _jpeg_options, exif_header=True),
+    "jpeg_progressive": OutputFormat(".jpg", "JPEG", _progressive_jpeg_options, exif_header=True),
+    "webp": OutputFormat(".webp", "WEBP", _webp_options, OUTPUT_QUALITY_POINTS["webp"],
+                         plugin=lambda: features.check_module("webp"), requirement="Pillow built with WebP support"),
+    "heif": OutputFormat(".heic", "HEIF", _heif_options, OUTPUT_QUALITY_POINTS["heif"], plugin=register_heif_plugin,
+                         requirement="pillow_heif (pip install pillow_heif)"),
+    "avif": OutputFormat(".avif", "AVIF", _avif_options, OUTPUT_QUALITY_POINTS["avif"], plugin=register_avif_plugin,
+                         requirement="Pillow 11.2+ with AVIF support or pillow-avif-plugin"),
+}
+
+
+def available_output_formats():
+    """ชื่อ (บน GUI) ของรูปแบบไฟล์ใน OUTPUT_FORMATS ที่ encode ได้ในเครื่องนี้"""
+    return [name for name, code in OUTPUT_FORMATS.items() if OUTPUT_FORMAT_BACKENDS[code].is_available()]
+
+
+def encode_image(image, quality, exif_bytes, output_format=DEFAULT_OUTPUT_FORMAT, subsampling=DEFAULT_SUBSAMPLING):
+    """encode ภาพตาม output_format (ค่าใน OUTPUT_FORMATS) ในหน่วยความจำ คืนค่า BytesIO"""
+    return OUTPUT_FORMAT_BACKENDS[output_format].encode(image, quality, exif_bytes, subsampling)
+
+
+def encode_image_to_size(image, max_quality, max_bytes, exif_bytes, output_format=DEFAULT_OUTPUT_FORMAT,
+                         subsampling=DEFAULT_SUBSAMPLING):
+    """
+    หาคุณภาพสูงสุด (ไม่เกิน max_quality) ที่ได้ไฟล์ไม่เกิน max_bytes ด้วย binary search
+    encode ในหน่วยความจำทั้งหมด ไม่เขียนไฟล์ระหว่างทาง คืนค่า (BytesIO, คุณภาพที่เลือก)
+    ถ้าแม้คุณภาพ 1 ก็ยังใหญ่เกิน จะคืนผลของคุณภาพ 1
+    """
+    output = encode_image(image, max_quality, exif_bytes, output_format, subsampling)
+    if output.getbuffer().nbytes <= max_bytes:
+        return output, max_quality
+
+    best = None
+    smallest = (output, max_quality) # ถ้าไม่มีคุณภาพไหนพอดี การค้นหาจะลงไปจนถึงคุณภาพ 1
+    low, high = 1, max_quality - 1
+    while low <= high:
+        quality = (low + high) // 2
+        candidate = encode_image(image, quality, exif_bytes, output_format, subsampling)
+        if candidate.getbuffer().nbytes <= max_bytes:
+            best = (candidate, quality)
+            low = quality + 1
+        else:
+            smallest = (candidate, quality)
+            high = quality - 1
+    return best or smallest
+
+
+def save_image(image, jpg_path, jpg_quality, exif_bytes, stats, max_bytes=None, output_format=DEFAULT_OUTPUT_FORMAT,
+               subsampling=DEFAULT_SUBSAMPLING):
+    """
+    encode ภาพตาม output_format ในหน่วยความจำ แล้วเขียนลงไฟล์ (แยกเวลา encode กับ write)
+    ถ้ากำหนด max_bytes จะใช้คุณภาพสูงสุดที่ไม่เกิน jpg_quality และได้ไฟล์ไม่เกิน max_bytes
+    คุณภาพที่ใช้จริงถูกบันทึกใน stats.qualities
+    """
+    with stats.stage("encode"):
+        if max_bytes:
+            output, jpg_quality = encode_image_to_size(image, jpg_quality, max_bytes, exif_bytes, output_format,
+                                                       subsampling)
+            if output.getbuffer().nbytes > max_bytes:
+                logger.warning("%s is %d bytes at quality 1, over the %d byte limit",
+                               jpg_path, output.getbuffer().nbytes, max_bytes)
+        else:
+            output = encode_image(image, jpg_quality, exif_bytes, output_format, subsampling)
+    stats.qualities[jpg_path] = jpg_quality
+    write_output_bytes(jpg_path, output.getbuffer(), stats)
+
+
+def resize_image(image, size, resize_mode=DEFAULT_RESIZE_MODE):
+    """ย่อภาพเป็น size (width, height) ตามโหมดใน RESIZE_MODES"""
+    return image.resize(size, Image.LANCZOS, reducing_gap=RESIZE_REDUCING_GAP[resize_mode])
+
+
+def largest_target(outputs):
+    """ขนาดเป้าหมายที่ใหญ่ที่สุดของ outputs [(path, target_mpx_value, quality, max_bytes), ...] (None = ขนาดเดิม)"""
+    targets = [output[1] for output in outputs]
+    return None if None in targets else max(targets)
+
+
+def write_renditions(image, outputs, reference_width, reference_height, exif_bytes, stats, resize_mode,
+                     passthrough=None, output_format=DEFAULT_OUTPUT_FORMAT, subsampling=DEFAULT_SUBSAMPLING):
+    """
+    ย่อภาพที่ decode แล้วเป็นทุก rendition ใน outputs แล้ว encode (ตาม output_format) และเขียนลงไฟล์
+    ขนาดของแต่ละ rendition คำนวณจาก reference_width x reference_height (ขนาดเต็มของภาพ)
+    rendition ถูกทำจากใหญ่ไปเล็ก และแต่ละขนาดย่อต่อจากขนาดก่อนหน้า จึงไม่ต้องย่อจากภาพเต็มทุกครั้ง
+    passthrough คือ bytes ของ JPEG ขนาดเท่ากับ image ที่เขียนลงไฟล์ได้เลยโดยไม่ encode ใหม่ (ถ้ามี)
+    ใช้ได้เฉพาะ rendition ที่ไม่จำกัดขนาดไฟล์ หรือ passthrough ไม่เกินขนาดที่กำหนด
+    """
+    source = image
+    for jpg_path, target_mpx_value, jpg_quality, max_bytes in sorted(outputs, key=lambda output: -(output[1] or math.inf)):
+        new_width, new_height = calculate_new_dimensions(reference_width, reference_height, target_mpx_value)
+        if (passthrough is not None and (new_width, new_height) == image.size
+                and (not max_bytes or len(passthrough) <= max_bytes)):
+            write_output_bytes(jpg_path, passthrough, stats)
+            stats.qualities[jpg_path] = None
+        else:
+            with stats.stage("resize"):
+                if (new_width, new_height) != source.size:
+                    source = resize_image(source, (new_width, new_height), resize_mode)
+            save_image(source, jpg_path, jpg_quality, exif_bytes, stats, max_bytes, output_format, subsampling)
+        stats.pixels_out += new_width * new_height
+
+
+def write_embedded_preview(raw, dng_path, outputs, full_width, full_height, stats, resize_mode=DEFAULT_RESIZE_MODE,
+                           output_format=DEFAULT_OUTPUT_FORMAT, subsampling=DEFAULT_SUBSAMPLING):
+    """
+    เขียนไฟล์ปลายทางทุก rendition จากภาพ preview ที่ฝังอยู่ในไฟล์ raw โดยไม่ decode ข้อมูล raw
+    - ถ้า preview ใหญ่กว่าขนาดที่ต้องการ จะย่อแล้ว encode ใหม่
+    - ถ้าเป็น JPEG ขนาดพอดีอยู่แล้วและ output_format เป็น baseline JPEG จะเขียน bytes เดิมลงไฟล์
+      (ใส่ EXIF ของต้นฉบับเข้าไป) โดยไม่ encode ใหม่
+    คืนค่า False ถ้าไม่มี preview ที่ใช้ได้สำหรับ rendition ที่ใหญ่ที่สุด (ให้ผู้เรียก decode เต็มแทน)
+    """
+    with stats.stage("read"):
+        try:
+            thumb = raw.extract_thumb()
+        except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+            return False
+
+    if thumb.format == rawpy.ThumbFormat.JPEG:
+        image = Image.open(io.BytesIO(thumb.data)) # อ่านแค่ header ยังไม่ decode พิกเซล
+    else:
+        image = Image.fromarray(thumb.data)
+
+    target_width, target_height = calculate_new_dimensions(full_width, full_height, largest_target(outputs))
+    preview_width, preview_height = image.size
+    if preview_width * preview_height < target_width * target_height * PREVIEW_MIN_AREA_RATIO:
+        logger.debug("Embedded preview of %s is too small (%dx%d)", dng_path, preview_width, preview_height)
+        return False
+
+    stats.source = "preview"
+    stats.bytes_read = len(thumb.data) if thumb.format == rawpy.ThumbFormat.JPEG else thumb.data.nbytes
+    stats.pixels_in = preview_width * preview_height
+
+    with stats.stage("exif"):
+        exif_bytes = read_exif_bytes(dng_path)
+
+    passthrough = None
+    if thumb.format == rawpy.ThumbFormat.JPEG and output_format == "jpeg":
+        # ใช้ JPEG เดิมได้เลยสำหรับ rendition ที่ขนาดเท่า preview แค่แทนที่ EXIF ด้วยของไฟล์ต้นฉบับ
+        if any(calculate_new_dimensions(preview_width, preview_height, output[1]) == image.size
+               for output in outputs):
+            with stats.stage("encode"):
+                passthrough = thumb.data
+                if exif_bytes:
+                    output = io.BytesIO()
+                    piexif.insert(exif_bytes, passthrough, output)
+                    passthrough = output.getvalue()
+    if passthrough is None or len(outputs) > 1 or (outputs[0][3] and len(passthrough) > outputs[0][3]):
+        with stats.stage("resize"):
+            image = image.convert('RGB')
+
+    write_renditions(image, outputs, preview_width, preview_height, exif_bytes, stats, resize_mode, passthrough,
+                     output_format, subsampling)
+    return True
+
+
+def export_renditions(dng_path, outputs, decode_mode=DEFAULT_DECODE_MODE, resize_mode=DEFAULT_RESIZE_MODE,
+                      output_format=DEFAULT_OUTPUT_FORMAT, subsampling=DEFAULT_SUBSAMPLING):
+    """
+    แปลงไฟล์ raw หนึ่งไฟล์เป็นภาพหลายขนาด โดย decode และอ่าน EXIF เพียงครั้งเดียว
+    outputs คือ list ของ (jpg_path, target_mpx_value, jpg_quality, max_bytes) หนึ่งรายการต่อหนึ่ง rendition
+    (max_bytes = ขนาดไฟล์สูงสุด ซึ่งทำให้ jpg_quality เป็นคุณภาพสูงสุดที่ค้นหา, None = ใช้ jpg_quality ตรงๆ)
+    การ decode เลือกตาม rendition ที่ใหญ่ที่สุด และการย่อขนาดใช้ resize_mode (ค่าใน RESIZE_MODES)
+    ไฟล์ปลายทาง encode ตาม output_format (ค่าใน OUTPUT_FORMATS) และ subsampling (ค่าใน CHROMA_SUBSAMPLINGS)
+    ใช้ได้ทั้งใน thread ของ GUI และใน worker process (ต้องอยู่ระดับ module เพื่อให้ pickle ได้)
+    คืนค่าผลการวัดของไฟล์นี้ (ConversionStats.as_dict()) ซึ่งรวมทุก rendition
+    """
+    stats = ConversionStats()
+    if decode_mode == "preview":
+        # ใช้ path ตรงๆ: LibRaw และ exifread จะอ่านเฉพาะ header และ preview ไม่ต้องโหลดทั้งไฟล์
+        data = None
+        raw_input = dng_path
+    else:
+        # อ่านไฟล์ครั้งเดียว แล้วใช้ buffer เดียวกันทั้ง rawpy และ exifread
+        with stats.stage("read"):
+            data = read_source_file(dng_path)
+        stats.bytes_read = len(data)
+        raw_input = io.BytesIO(data) # BytesIO ของ bytes ไม่ copy ข้อมูลซ้ำ
+
+    with rawpy.imread(raw_input) as raw:
+        full_width, full_height = get_output_dimensions(raw)
+        if decode_mode == "preview" and write_embedded_preview(raw, dng_path, outputs, full_width, full_height, stats,
+                                                               resize_mode, output_format, subsampling):
+            return stats.as_dict()
+
+        options, half_size = choose_postprocess_options(full_width, full_height, largest_target(outputs), decode_mode)
+
+        with stats.stage("decode"):
+            rgb = raw.postprocess(
+                use_camera_wb=True,
+                output_color=rawpy.ColorSpace.sRGB,
+                no_auto_bright=True,
+                **options
+            )
+
+            image = Image.fromarray(rgb)
+        if data is None: # preview ใช้ไม่ได้ LibRaw อ่านทั้งไฟล์จาก path
+            stats.bytes_read = os.path.getsize(dng_path)
+        stats.pixels_in = image.width * image.height
+
+        # อ่าน EXIF ครั้งเดียว ใช้กับทุก rendition
+        with stats.stage("exif"):
+            exif_bytes = read_exif_bytes(dng_path, data)
+
+        # ถ้า decode แบบ half size คำนวณขนาดจากขนาดเต็มของเซนเซอร์ เพื่อให้ได้ขนาดเดียวกับการ decode เต็ม
+        reference_width, reference_height = (full_width, full_height) if half_size else image.size
+        write_renditions(image, outputs, reference_width, reference_height, exif_bytes, stats, resize_mode,
+                         output_format=output_format, subsampling=subsampling)
+
+    return stats.as_dict()
+
+
+def convert_single_file(dng_path, jpg_path, target_mpx_value, jpg_quality, decode_mode=DEFAULT_DECODE_MODE,
+                        resize_mode=DEFAULT_RESIZE_MODE, max_bytes=None, output_format=DEFAULT_OUTPUT_FORMAT,
+                        subsampling=DEFAULT_SUBSAMPLING):
+    """
+    แปลงไฟล์ DNG หนึ่งไฟล์เป็น JPG (หรือ output_format อื่น) พร้อมปรับขนาดและคุณภาพ
+    คืนค่าผลการวัดของไฟล์นี้ (ConversionStats.as_dict())
+    """
+    return export_renditions(dng_path, [(jpg_path, target_mpx_value, jpg_quality, max_bytes)], decode_mode,
+                             resize_mode, output_format, subsampling)
+
+
+# --- Renditions ---
+
+def make_rendition(target_mpx_value, jpg_quality, suffix="", subfolder="", max_bytes=None):
+    """
+    rendition หนึ่งรายการ: ขนาด (ค่าจาก MPX_OPTIONS), คุณภาพ JPG
+    และชื่อที่ต่อท้ายไฟล์ (suffix) และ/หรือโฟลเดอร์ย่อยในโฟลเดอร์ปลายทาง (subfolder)
+    ถ้ากำหนด max_bytes จะใช้คุณภาพสูงสุด (ไม่เกิน jpg_quality) ที่ได้ไฟล์ไม่เกินขนาดนี้
+    """
+    return {"target_mpx": target_mpx_value, "quality": jpg_quality, "max_bytes": max_bytes, "suffix": suffix,
+            "subfolder": subfolder}
+
+
+def parse_file_size(text):
+    """
+    แปลงข้อความขนาดไฟล์เช่น "2MB", "500 KB" หรือ "750000" (bytes) เป็นจำนวน bytes
+    1 KB = 1000 bytes และ 1 MB = 1000 KB (FILE_SIZE_UNITS)
+    """
+    value = text.strip().lower().replace(' ', '')
+    number = value.rstrip("kmgb")
+    unit = value[len(number):] or "b"
+    try:
+        size = float(number) * FILE_SIZE_UNITS[unit]
+    except (ValueError, KeyError):
+        raise ValueError(f"Invalid file size {text!r}, expected e.g. 2MB, 500KB or a number of bytes") from None
+    if not math.isfinite(size): # float() รับ "inf" และ "nan" ได้
+        raise ValueError(f"Invalid file size {text!r}, expected e.g. 2MB, 500KB or a number of bytes")
+    if size < 1:
+        raise ValueError(f"Invalid file size {text!r}, must be greater than 0")
+    return int(size)
+
+
+def parse_rendition(text):
+    """
+    แปลงข้อความ "PRESET:QUALITY[:SUFFIX[:SUBFOLDER]]" เป็น rendition
+    PRESET คือชื่อใน MPX_OPTIONS (ไม่สนตัวพิมพ์เล็ก/ใหญ่) หรือตัวเลขเช่น "12" สำหรับ "12 MPX"
+    QUALITY คือคุณภาพ 1-100 หรือขนาดไฟล์สูงสุดเช่น "2MB" (ใช้คุณภาพสูงสุดที่ไม่เกินขนาดนั้น)
+    ตัวอย่าง: "Original:95::archive", "12 MPX:90:_print", "2:2MB:_web:web"
+    """
+    parts = [part.strip() for part in text.split(':')]
+    if len(parts) < 2 or len(parts) > 4:
+        raise ValueError(f"Invalid rendition {text!r}, expected PRESET:QUALITY[:SUFFIX[:SUBFOLDER]]")
+    preset, quality = parts[0], parts[1]
+    presets = {name.lower(): value for name, value in MPX_OPTIONS.items()}
+    key = preset.lower() if preset.lower() in presets else f"{preset} mpx".lower()
+    if key not in presets:
+        raise ValueError(f"Unknown MPX preset {preset!r}, expected one of: {', '.join(MPX_OPTIONS)}")
+    max_bytes = None
+    if quality.isdigit():
+        if not 1 <= int(quality) <= 100:
+            raise ValueError(f"Invalid quality {quality!r} in rendition {text!r}, expected 1-100")
+        quality = int(quality)
+    else:
+        try:
+            max_bytes = parse_file_size(quality)
+        except ValueError:
+            raise ValueError(f"Invalid quality {quality!r} in rendition {text!r}, "
+                             "expected 1-100 or a file size such as 2MB") from None
+        quality = 100
+    suffix = parts[2] if len(parts) > 2 else ""
+    subfolder = parts[3] if len(parts) > 3 else ""
+    return make_rendition(presets[key], quality, suffix, subfolder, max_bytes)
+
+
+def parse_renditions(text):
+    """แปลงหลาย rendition ที่คั่นด้วย ; (ใช้ในช่อง Renditions ของ GUI) ข้อความว่างคืน list ว่าง"""
+    return [parse_rendition(item) for item in text.split(';') if item.strip()]
+
+
+def rendition_output_paths(output_folder, relative_path, renditions, extension='.jpg'):
+    """
+    path ของไฟล์ปลายทางของแต่ละ rendition:
+    output_folder/<subfolder>/<โฟลเดอร์ย่อยของต้นฉบับ>/<ชื่อไฟล์><suffix><extension>
+    แจ้ง ValueError ถ้ามีสอง rendition เขียนไฟล์เดียวกัน
+    """
+    stem = os.path.splitext(relative_path)[0]
+    paths = [os.path.join(output_folder, rendition["subfolder"], stem + rendition["suffix"] + extension)
+             for rendition in renditions]
+    if len(set(paths)) != len(paths):
+        raise ValueError("Each rendition needs a different suffix or subfolder")
+    return paths
+
+
+# --- Input discovery ---
+
+def parse_extensions(text):
+    """แปลงข้อความเช่น "dng, .CR2 .nef" เป็น tuple (".dng", ".cr2", ".nef")"""
+    extensions = []
+    for item in text.replace(',', ' ').split():
+        item = item.lower()
+        extensions.append(item if item.startswith('.') else '.' + item)
+    return tuple(extensions) or DEFAULT_EXTENSIONS
+
+
+def scan_raw_files(input_folder, extensions=DEFAULT_EXTENSIONS, recursive=True, exclude_folders=()):
+    """
+    Generator ที่ค่อยๆ คืน path แบบ relative (เทียบกับ input_folder) ของไฟล์ที่มีนามสกุลตรงกับ extensions
+    ใช้ os.scandir ทีละโฟลเดอร์และคืนไฟล์ตามลำดับที่ระบบไฟล์ส่งมา (ไม่เรียงชื่อ) จึงเริ่มคืนไฟล์แรกได้ทันที
+    โดยไม่ต้องรอ list ทั้งโฟลเดอร์ แม้เป็นโฟลเดอร์ใหญ่บน network share
+    ข้ามโฟลเดอร์ซ่อน (ขึ้นต้นด้วย .) และโฟลเดอร์ใน exclude_folders (เช่นโฟลเดอร์ปลายทางที่อยู่ในโฟลเดอร์ต้นฉบับ)
+    ไม่เข้าไปใน symlink ของโฟลเดอร์ (เหมือน os.walk) เพราะลิงก์ที่ชี้กลับขึ้นไปจะทำให้สแกนวนไม่รู้จบ
+    """
+    extensions = tuple(extension.lower() for extension in extensions)
+    excluded = {os.path.normcase(os.path.abspath(folder)) for folder in exclude_folders}
+    pending = [""]
+    while pending:
+        relative_folder = pending.pop()
+        folder = os.path.join(input_folder, relative_folder)
+        subfolders = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    relative_path = os.path.join(relative_folder, entry.name)
+                    if entry.is_file():
+                        if entry.name.lower().endswith(extensions):
+                            yield relative_path
+                    elif recursive and entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.'):
+                        if os.path.normcase(os.path.abspath(entry.path)) not in excluded:
+                            subfolders.append(relative_path)
+        except OSError as e:
+            logger.warning("Could not scan %s: %s", folder, e)
+        # pop() จากท้าย list จึงเรียงกลับด้านเพื่อให้โฟลเดอร์ย่อยถูกสแกนตามลำดับชื่อ
+        pending.extend(sorted(subfolders, reverse=True))
+
+
+class BackgroundScanner:
+    """
+    รัน scan_raw_files ใน thread แยก เพื่อให้เริ่มแปลงไฟล์แรกได้ระหว่างที่ยังสแกนโฟลเดอร์อื่นอยู่
+    discovered คือจำนวนไฟล์ที่พบแล้ว และ finished บอกว่าสแกนครบแล้วหรือยัง
+    ถ้ากำหนด files (path relative กับ input_folder) จะคืนเฉพาะไฟล์เหล่านั้นแทนการสแกน
+    """
+
+    _DONE = object()
+
+    def __init__(self, input_folder, extensions=DEFAULT_EXTENSIONS, recursive=True, exclude_folders=(), files=None):
+        self.discovered = 0
+        self.finished = False
+        self._files = None if files is None else [os.path.normpath(path) for path in files]
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(input_folder, extensions, recursive, exclude_folders),
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self, input_folder, extensions, recursive, exclude_folders):
+        if self._files is not None:
+            paths = self._files
+        else:
+            paths = scan_raw_files(input_folder, extensions, recursive, exclude_folders)
+        try:
+            for relative_path in paths:
+                if self._stop.is_set():
+                    break
+                self.discovered += 1
+                self._queue.put(relative_path)
+            else:
+                # discovered เป็นจำนวนสุดท้ายแล้ว แม้ไฟล์ท้ายๆ จะยังรออยู่ในคิว
+                self.finished = True
+        finally:
+            self._queue.put(self._DONE)
+
+    def stop(self):
+        self._stop.set()
+
+    def __iter__(self):
+        """
+        คืน path ของไฟล์ตามลำดับที่พบ ถ้ายังไม่มีไฟล์ใหม่ภายใน SCAN_POLL_INTERVAL จะคืน None
+        เพื่อให้ผู้เรียกได้ไปทำงานอื่น (เช่น เก็บผลของ worker) ก่อนกลับมารอต่อ
+        """
+        while True:
+            try:
+                item = self._queue.get(timeout=SCAN_POLL_INTERVAL)
+            except queue.Empty:
+                yield None
+                continue
+            if item is self._DONE:
+                return
+            yield item
+
+
+# --- Watch folder ---
+
+# ค่าคงที่ของ inotify (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+
+class InotifyWatcher:
+    """
+    คืน path (relative) ของไฟล์ที่ถูกสร้าง เขียน หรือย้ายเข้ามาในโฟลเดอร์ ด้วย inotify ของ Linux ผ่าน ctypes
+    ถ้า recursive จะเพิ่ม watch ให้โฟลเดอร์ย่อยที่สร้างขึ้นใหม่ด้วย (ข้ามโฟลเดอร์ซ่อนและ exclude_folders เหมือน scan_raw_files)
+    แจ้ง OSError ถ้าใช้ inotify ไม่ได้ ให้ผู้เรียกใช้การสแกนเป็นระยะแทน
+    """
+
+    _EVENT = struct.Struct("iIII") # wd, mask, cookie, len ตามด้วยชื่อไฟล์ยาว len bytes
+    _MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, input_folder, recursive=True, exclude_folders=()):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        import ctypes
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._get_errno = ctypes.get_errno
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(self._get_errno(), "inotify_init1 failed")
+        self.input_folder = input_folder
+        self.recursive = recursive
+        self._excluded = {os.path.normcase(os.path.abspath(folder)) for folder in exclude_folders}
+        self._folders = {} # watch descriptor -> โฟลเดอร์ (relative)
+        try:
+            self._add_tree("")
+        except OSError:
+            self.close()
+            raise
+
+    def _add_tree(self, relative_folder):
+        """เพิ่ม watch ให้โฟลเดอร์และโฟลเดอร์ย่อย คืน path ของไฟล์ที่มีอยู่แล้วในนั้น"""
+        files = []
+        pending = [relative_folder]
+        while pending:
+            relative = pending.pop()
+            folder = os.path.join(self.input_folder, relative)
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), self._MASK)
+            if wd < 0:
+                raise OSError(self._get_errno(), f"inotify_add_watch failed for {folder}")
+            self._folders[wd] = relative
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            files.append(os.path.join(relative, entry.name))
+                        elif (self.recursive and entry.is_dir(follow_symlinks=False)
+                              and self._should_watch(entry.name, entry.path)):
+                            pending.append(os.path.join(relative, entry.name))
+            except OSError as e:
+                logger.warning("Could not scan %s: %s", folder, e)
+        return files
+
+    def _should_watch(self, name, path):
+        return not name.startswith('.') and os.path.normcase(os.path.abspath(path)) not in self._excluded
+
+    def read(self, timeout):
+        """
+        รอ event ไม่เกิน timeout วินาที คืน list ของ path (relative) ที่เปลี่ยน
+        คืน None ถ้า event ล้นคิวของ kernel (ผู้เรียกควรสแกนใหม่ทั้งหมด)
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changed = []
+        overflow = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED: # โฟลเดอร์ถูกลบหรือย้ายออกไป
+                self._folders.pop(wd, None)
+                continue
+            folder = self._folders.get(wd)
+            if folder is None or not name:
+                continue
+            relative_path = os.path.join(folder, name)
+            if mask & IN_ISDIR:
+                path = os.path.join(self.input_folder, relative_path)
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO) and self._should_watch(name, path):
+                    try:
+                        # ไฟล์ที่ถูกคัดลอกมาพร้อมโฟลเดอร์ก่อนเพิ่ม watch จะไม่มี event จึงต้องสแกนเอง
+                        changed.extend(self._add_tree(relative_path))
+                    except OSError as e:
+                        logger.warning("Could not watch %s: %s", path, e)
+            else:
+                changed.append(relative_path)
+        return None if overflow else changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class FolderWatcher(BackgroundScanner):
+    """
+    BackgroundScanner ที่ไม่จบหลังสแกนครั้งแรก แต่เฝ้าโฟลเดอร์ต่อจนกว่า stop_event จะถูก set
+    ไฟล์ใหม่หรือไฟล์ที่ถูกเขียนทับจะถูกส่งต่อเมื่อขนาดและเวลาแก้ไขไม่เปลี่ยนนาน WATCH_SETTLE_SECONDS
+    ใช้ inotify บน Linux และสแกนโฟลเดอร์ใหม่ทุก WATCH_RESCAN_INTERVAL วินาทีบน platform อื่น
+    finished เป็น False ตลอด เพราะจำนวนไฟล์ทั้งหมดไม่มีวันสิ้นสุด
+    """
+
+    def __init__(self, input_folder, extensions=DEFAULT_EXTENSIONS, recursive=True, exclude_folders=(),
+                 stop_event=None):
+        self._stop_event = stop_event or threading.Event()
+        super().__init__(input_folder, extensions, recursive, exclude_folders)
+
+    def _stopped(self):
+        return self._stop.is_set() or self._stop_event.is_set()
+
+    def _run(self, input_folder, extensions, recursive, exclude_folders):
+        extensions = tuple(extension.lower() for extension in extensions)
+        known = {}   # path -> (size, mtime_ns) ที่ส่งต่อไปแล้ว
+        pending = {} # path -> ((size, mtime_ns), เวลาที่เห็นค่านี้ครั้งแรก)
+        inotify = None
+
+        def state(relative_path):
+            try:
+                stat = os.stat(os.path.join(input_folder, relative_path))
+            except OSError:
+                return None
+            return stat.st_size, stat.st_mtime_ns
+
+        def emit(relative_path, file_state):
+            known[relative_path] = file_state
+            self.discovered += 1
+            self._queue.put(relative_path)
+
+        def candidate(relative_path):
+            if relative_path.lower().endswith(extensions) and relative_path not in pending:
+                file_state = state(relative_path)
+                if file_state is not None and known.get(relative_path) != file_state:
+                    pending[relative_path] = (file_state, time.monotonic())
+
+        def rescan():
+            for relative_path in scan_raw_files(input_folder, extensions, recursive, exclude_folders):
+                if self._stopped():
+                    return
+                candidate(relative_path)
+
+        try:
+            # สแกนครั้งแรก: ไฟล์ที่แก้ไขล่าสุดเกิน WATCH_SETTLE_SECONDS แล้วถือว่าเขียนเสร็จ ส่งต่อได้ทันที
+            for relative_path in scan_raw_files(input_folder, extensions, recursive, exclude_folders):
+                if self._stopped():
+                    return
+                file_state = state(relative_path)
+                if file_state is None:
+                    continue
+                if time.time() - file_state[1] / 1e9 >= WATCH_SETTLE_SECONDS:
+                    emit(relative_path, file_state)
+                else:
+                    pending[relative_path] = (file_state, time.monotonic())
+
+            try:
+                inotify = InotifyWatcher(input_folder, recursive, exclude_folders)
+                rescan() # ไฟล์ที่เข้ามาระหว่างสแกนครั้งแรกกับตอนเริ่ม inotify
+            except OSError as e:
+                logger.info("Watching %s by polling every %.1fs (%s)", input_folder, WATCH_RESCAN_INTERVAL, e)
+            last_rescan = time.monotonic()
+
+            while not self._stopped():
+                if inotify is not None:
+                    changed = inotify.read(WATCH_POLL_INTERVAL)
+                    if changed is None:
+                        rescan()
+                    else:
+                        for relative_path in changed:
+                            candidate(relative_path)
+                else:
+                    self._stop_event.wait(WATCH_POLL_INTERVAL)
+                    if time.monotonic() - last_rescan >= WATCH_RESCAN_INTERVAL:
+                        rescan()
+                        last_rescan = time.monotonic()
+
+                # ส่งต่อไฟล์ที่ขนาดและเวลาแก้ไขนิ่งแล้ว
+                now = time.monotonic()
+                for relative_path, (file_state, since) in list(pending.items()):
+                    current = state(relative_path)
+                    if current is None: # ไฟล์ถูกลบหรือเปลี่ยนชื่อ
+                        del pending[relative_path]
+                    elif current != file_state:
+                        pending[relative_path] = (current, now)
+                    elif now - since >= WATCH_SETTLE_SECONDS:
+                        del pending[relative_path]
+                        emit(relative_path, current)
+        finally:
+            if inotify is not None:
+                inotify.close()
+            self._queue.put(self._DONE)
+
+
+# --- Memory budget ---
+
+def read_raw_dimensions(dng_path):
+    """
+    อ่านขนาดภาพจาก header ของไฟล์ raw โดยไม่ unpack/decode ข้อมูล raw
+    คืนค่า None ถ้าอ่านไม่ได้
+    """
+    raw = rawpy.RawPy()
+    try:
+        raw.open_file(dng_path)
+        return get_output_dimensions(raw)
+    except Exception as e:
+        logger.debug("Could not read raw dimensions of %s: %s", dng_path, e)
+        return None
+    finally:
+        raw.close()
+
+
+def estimate_peak_memory(dng_path, target_mpx_value, decode_mode):
+    """
+    ประมาณหน่วยความจำสูงสุด (bytes) ที่ใช้ในการแปลงไฟล์หนึ่งไฟล์ จากขนาดเซนเซอร์และขนาดปลายทาง
+    """
+    file_size = os.path.getsize(dng_path)
+    dimensions = read_raw_dimensions(dng_path)
+    if dimensions is None:
+        # ไฟล์ raw แบบไม่บีบอัดใช้ประมาณ 2 bytes ต่อพิกเซล ใช้ขนาดไฟล์ประมาณแทน
+        full_width, full_height = file_size // 2, 1
+    else:
+        full_width, full_height = dimensions
+
+    raw_pixels = full_width * full_height
+    _, half_size = choose_postprocess_options(full_width, full_height, target_mpx_value, decode_mode)
+    decoded_pixels = raw_pixels // 4 if half_size else raw_pixels
+    new_width, new_height = calculate_new_dimensions(full_width, full_height, target_mpx_value)
+
+    return (WORKER_BASE_MEMORY
+            + file_size              # buffer ของไฟล์ต้นฉบับ (read_source_file)
+            + raw_pixels * 2         # ข้อมูล raw 16-bit ที่ LibRaw unpack
+            + decoded_pixels * 8     # ภาพทำงานของ LibRaw (4 channel x 16-bit)
+            + decoded_pixels * 3 * 2 # ผลลัพธ์ postprocess + สำเนาใน Image.fromarray
+            + new_width * new_height * 3) # ภาพหลังย่อขนาด
+
+
+class MemoryBudget:
+    """
+    ควบคุมจำนวนไฟล์ที่แปลงพร้อมกันตามงบหน่วยความจำ
+    ไฟล์ที่ใหญ่กว่างบทั้งหมดยังแปลงได้ แต่จะแปลงเมื่อไม่มีไฟล์อื่นกำลังแปลงอยู่เท่านั้น
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes # None หรือ 0 = ไม่จำกัด
+        self.in_use = 0
+
+    def fits(self, amount):
+        return not self.limit_bytes or not self.in_use or self.in_use + amount <= self.limit_bytes
+
+    def acquire(self, amount):
+        self.in_use += amount
+
+    def release(self, amount):
+        self.in_use -= amount
+
+
+def get_process_memory():
+    """
+    คืนค่า (RSS ปัจจุบัน, RSS สูงสุด) ของ process นี้เป็น bytes
+    ค่าที่หาไม่ได้บน platform นั้นจะเป็น None
+    """
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize, counters.PeakWorkingSetSize
+        return None, None
+
+    current = peak = None
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if peak is None:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if sys.platform != "darwin": # Linux รายงานเป็น KB, macOS เป็น bytes
+                peak *= 1024
+        except ImportError:
+            pass
+    return current, peak
+
+
+class MemoryMonitor:
+    """
+    รวมหน่วยความจำของ process หลักและ worker ทุกตัว
+    peak คือผลรวมของค่าสูงสุดของแต่ละ process (ค่าบนสุดที่อาจเกิดขึ้นได้)
+    """
+
+    def __init__(self):
+        self.workers = {} # pid -> (current, peak)
+
+    def update_worker(self, pid, current, peak):
+        self.workers[pid] = (current, peak)
+
+    def forget_workers(self):
+        """ลืม worker ทั้งหมด เมื่อ pool เดิมถูกปิดและไม่มี process เหล่านั้นแล้ว"""
+        self.workers.clear()
+
+    def snapshot(self):
+        current, peak = get_process_memory()
+        for worker_current, worker_peak in self.workers.values():
+            current = None if current is None or worker_current is None else current + worker_current
+            peak = None if peak is None or worker_peak is None else peak + worker_peak
+        return {"current_rss": current, "peak_rss": peak}
+
+
+def format_error(error):
+    """ข้อความของ exception สำหรับผลลัพธ์/log: error ของ LibRaw มีข้อความเป็น bytes จึง decode แทนการแสดง b'...'"""
+    if len(error.args) == 1 and isinstance(error.args[0], bytes):
+        return error.args[0].decode('utf-8', errors='replace')
+    return str(error)
+
+
+def format_memory(snapshot):
+    """ข้อความสั้นๆ สำหรับแสดงหน่วยความจำปัจจุบัน/สูงสุดบน GUI และ CLI"""
+    def mb(value):
+        return "n/a" if value is None else f"{value / (1024 * 1024):.0f} MB"
+    return f"Memory: {mb(snapshot['current_rss'])} (peak {mb(snapshot['peak_rss'])})"
+
+
+def limit_worker_threads(workers):
+    """
+    แบ่ง core ให้ OpenMP ของ LibRaw ในแต่ละ worker (cpu_count // workers, อย่างน้อย 1 thread)
+    ไม่เช่นนั้นทุก worker จะ demosaic ด้วย thread เท่าจำนวน core ทำให้มี thread เกินจำนวน core หลายเท่า
+    ต้องตั้งใน environment ของ process หลักก่อน spawn เพราะ libgomp อ่านค่าตอน import rawpy ใน worker
+    ซึ่งเกิดก่อน initializer (process หลัก import rawpy ไปแล้ว จึงไม่ได้รับผลกระทบ)
+    """
+    if USER_OMP_THREADS is None:
+        os.environ["OMP_NUM_THREADS"] = str(max(1, (os.cpu_count() or 1) // workers))
+
+
+def init_worker():
+    """
+    initializer ของ worker process: ไม่รับ Ctrl+C (SIGINT ถูกส่งถึงทุก process ใน process group)
+    ให้ process หลักเป็นผู้ยกเลิกผ่าน stop_event แล้ว worker แปลงไฟล์ที่ทำอยู่จนเสร็จ
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_conversion_job(dng_path, outputs, decode_mode, resize_mode, output_format, subsampling):
+    """
+    งานที่ส่งให้ worker process: แปลงไฟล์ (ทุก rendition) แล้วส่งผลการวัดและหน่วยความจำของ worker กลับมา
+    """
+    stats = export_renditions(dng_path, outputs, decode_mode, resize_mode, output_format, subsampling)
+    current, peak = get_process_memory()
+    return {"pid": os.getpid(), "current_rss": current, "peak_rss": peak, "stats": stats}
+
+
+# --- Instrumentation ---
+
+class ThroughputMeter:
+    """
+    ความเร็วของ batch (files/sec, MB/sec ของไฟล์ต้นฉบับ) และเวลาที่เหลือโดยประมาณ
+    คิดจากไฟล์ที่แปลงจริงเท่านั้น ไฟล์ที่ข้ามไม่นับ
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = 0
+        self.bytes_read = 0
+
+    def add(self, stats):
+        self.files += 1
+        if stats:
+            self.bytes_read += stats["bytes_read"]
+
+    def snapshot(self, remaining_files):
+        elapsed = time.perf_counter() - self.started
+        files_per_second = self.files / elapsed if elapsed > 0 else 0.0
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "files_per_second": round(files_per_second, 3),
+            "mb_per_second": round(self.bytes_read / (1024 * 1024) / elapsed, 3) if elapsed > 0 else 0.0,
+            "eta_seconds": round(remaining_files / files_per_second, 1) if files_per_second else None,
+        }
+
+
+def format_throughput(throughput):
+    """ข้อความสั้นๆ ของความเร็วและเวลาที่เหลือ สำหรับ GUI และ CLI"""
+    eta = throughput["eta_seconds"]
+    eta_text = "--:--" if eta is None else time.strftime("%H:%M:%S", time.gmtime(eta))
+    return f"{throughput['files_per_second']:.2f} files/s, {throughput['mb_per_second']:.1f} MB/s, ETA {eta_text}"
+
+
+def write_stats_log(summary, log_path):
+    """
+    บันทึกผลการวัดของทุกไฟล์ใน batch ลงไฟล์ log
+    ไฟล์ .csv จะได้หนึ่งแถวต่อหนึ่งไฟล์ (มีคอลัมน์เวลาของแต่ละ stage) นามสกุลอื่นจะเขียนเป็น JSON ทั้ง summary
+    """
+    folder = os.path.dirname(log_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    with atomic_output_path(log_path) as temp_path:
+        if not log_path.lower().endswith('.csv'):
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
+            return
+
+        with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["source", "status", "error", "decoded_from", "quality", "bytes_read", "bytes_written",
+                             "pixels_in", "pixels_out", "total_seconds"] + [f"{stage}_seconds" for stage in STAGES])
+            for result in summary["files"]:
+                stats = result.get("stats") or {}
+                stages = stats.get("stages", {})
+                # คุณภาพที่ใช้จริงของแต่ละ rendition ตามลำดับ outputs คั่นด้วย ; ("preview" = เขียน JPEG ของ preview เดิม)
+                qualities = stats.get("qualities", {})
+                quality = ";".join("preview" if qualities.get(path, "") is None else str(qualities.get(path, ""))
+                                   for path in result["outputs"]) if qualities else ""
+                writer.writerow([result["source"], result["status"], result["error"] or "", stats.get("source", ""),
+                                 quality, stats.get("bytes_read", ""), stats.get("bytes_written", ""),
+                                 stats.get("pixels_in", ""), stats.get("pixels_out", ""),
+                                 round(sum(stages.values()), 6) if stages else ""]
+                                + [stages.get(stage, "") for stage in STAGES])
+
+
+def convert_dng_to_jpg(input_folder, output_folder, target_mpx_value, jpg_quality, workers=1, progress_callback=None,
+                       force=False, decode_mode=DEFAULT_DECODE_MODE, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                       stats_log=None, extensions=DEFAULT_EXTENSIONS, recursive=True, renditions=None,
+                       resize_mode=DEFAULT_RESIZE_MODE, max_bytes=None, output_format=DEFAULT_OUTPUT_FORMAT,
+                       subsampling=DEFAULT_SUBSAMPLING, watch=False, stop_event=None, files=None):
+    """
+    ฟังก์ชันหลักสำหรับแปลงไฟล์ DNG ทั้งโฟลเดอร์เป็น JPG พร้อมปรับขนาดและคุณภาพ
+    ถ้า workers > 1 จะกระจายไฟล์ไปยัง process pool เพื่อใช้ทุก core ของเครื่อง
+    โดยจำนวนไฟล์ที่แปลงพร้อมกันจะถูกจำกัดด้วย memory_budget_mb (0 = ไม่จำกัด)
+
+    ไฟล์ต้นฉบับถูกค้นหาใน thread แยก (รวมโฟลเดอร์ย่อยถ้า recursive=True) และเริ่มแปลงทันทีที่พบไฟล์แรก
+    โครงสร้างโฟลเดอร์ย่อยถูกสร้างซ้ำในโฟลเดอร์ปลายทาง extensions กำหนดนามสกุลไฟล์ raw ที่จะแปลง
+
+    renditions (list ของ make_rendition/parse_rendition) กำหนดไฟล์ปลายทางหลายขนาดต่อหนึ่งไฟล์ต้นฉบับ
+    โดย decode เพียงครั้งเดียว ถ้าไม่กำหนดจะได้ไฟล์เดียวตาม target_mpx_value และ jpg_quality
+    max_bytes (ไม่บังคับ) จำกัดขนาดไฟล์ปลายทาง โดยใช้คุณภาพสูงสุดที่ไม่เกิน jpg_quality ที่ได้ไฟล์ไม่เกินขนาดนี้
+    คุณภาพที่ใช้จริงของแต่ละไฟล์อยู่ใน result["stats"]["qualities"]
+    output_format (ค่าใน OUTPUT_FORMATS) และ subsampling กำหนดรูปแบบและนามสกุลของไฟล์ปลายทาง
+
+    ไฟล์ที่ manifest บอกว่าแปลงแล้วด้วยค่าตั้งเดียวกันและต้นฉบับไม่เปลี่ยน จะถูกข้าม (status "skipped")
+    เว้นแต่ force=True
+
+    ถ้า watch=True จะไม่จบหลังแปลงไฟล์ที่มีอยู่ แต่เฝ้าโฟลเดอร์ต้นฉบับต่อ (FolderWatcher) และแปลงไฟล์ใหม่ทันที
+    ที่เขียนเสร็จ จนกว่า stop_event จะถูก set
+    stop_event (threading.Event) ใช้ยกเลิกได้ทุกโหมด: ไม่เริ่มไฟล์ใหม่อีก รอไฟล์ที่กำลังแปลงให้เสร็จแล้วจึงคืนค่า
+    (summary["cancelled"] เป็น True ถ้าไม่ใช่โหมด watch) ไฟล์ที่เหลือจะถูกแปลงในรอบถัดไปตาม manifest
+    files คือ list ของ path relative กับ input_folder (เหมือน result["source"]) ที่จะแปลงแทนการสแกนโฟลเดอร์
+    เช่นเพื่อลองแปลงไฟล์ที่ล้มเหลวใหม่
+
+    ไฟล์ที่แปลงไม่สำเร็จ (เช่นไฟล์ raw เสีย) จะถูก record เป็น "failed" แล้วแปลงไฟล์ที่เหลือต่อ
+    รายชื่อไฟล์เหล่านี้อยู่ใน summary["failed_files"]
+
+    progress_callback(done, total, result) จะถูกเรียกหลังแต่ละไฟล์เสร็จ (จาก thread ที่เรียกฟังก์ชันนี้)
+    ระหว่างที่ยังสแกนไม่เสร็จ total คือจำนวนไฟล์ที่พบแล้ว และ result["scan_complete"] เป็น False
+    result มีผลการวัดของไฟล์ ("stats") และความเร็วของ batch ณ ตอนนั้น ("throughput")
+    คืนค่าเป็น dict สรุปผล ซึ่งแปลงเป็น JSON ได้โดยตรง และบันทึกลง stats_log (.csv หรือ .json) ถ้ากำหนดไว้
+    """
+    if not os.path.isdir(input_folder):
+        raise FileNotFoundError(f"Input folder does not exist: {input_folder}")
+    if watch and files is not None:
+        raise ValueError("files cannot be combined with watch")
+    backend = OUTPUT_FORMAT_BACKENDS[output_format]
+    if not backend.is_available():
+        raise ValueError(f"{output_format} output is not available, it needs {backend.requirement}")
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    # ค่าตั้งที่มีผลต่อไฟล์ปลายทาง ถ้าเปลี่ยนไฟล์จะถูกแปลงใหม่
+    if renditions:
+        settings = {"renditions": renditions, "decode_mode": decode_mode, "resize_mode": resize_mode,
+                    "output_format": output_format, "subsampling": subsampling}
+    else:
+        settings = {"target_mpx": target_mpx_value, "quality": jpg_quality, "max_bytes": max_bytes,
+                    "decode_mode": decode_mode, "resize_mode": resize_mode, "output_format": output_format,
+                    "subsampling": subsampling}
+        renditions = [make_rendition(target_mpx_value, jpg_quality, max_bytes=max_bytes)]
+    rendition_output_paths(output_folder, "", renditions, backend.extension) # ตรวจว่าไม่มี rendition ใดเขียนทับกัน ก่อนเริ่มสแกน
+
+    started = time.perf_counter()
+    stop_event = stop_event or threading.Event()
+    if watch:
+        scanner = FolderWatcher(input_folder, extensions, recursive, exclude_folders=(output_folder,),
+                                stop_event=stop_event)
+    else:
+        scanner = BackgroundScanner(input_folder, extensions, recursive, exclude_folders=(output_folder,), files=files)
+    manifest = {} if force else load_manifest(output_folder)
+    results = []
+    unsaved = 0
+    last_saved = time.monotonic()
+    attempted = False
+    memory = MemoryMonitor()
+    throughput = ThroughputMeter()
+
+    def record(dng_file, jpg_paths, status, error=None, fingerprint=None, stats=None):
+        nonlocal unsaved, last_saved
+        if status == "converted":
+            outputs = [os.path.relpath(jpg_path, output_folder).replace(os.sep, '/') for jpg_path in jpg_paths]
+            manifest[dng_file] = dict(fingerprint, settings=settings, outputs=outputs)
+            unsaved += 1
+            if time.monotonic() - last_saved >= MANIFEST_SAVE_SECONDS:
+                save_manifest(output_folder, manifest)
+                unsaved = 0
+                last_saved = time.monotonic()
+        elif status == "failed":
+            manifest.pop(dng_file, None)
+        if status != "skipped":
+            throughput.add(stats)
+
+        result = {
+            "source": dng_file,
+            "output": jpg_paths[0],
+            "outputs": jpg_paths,
+            "status": status,
+            "error": format_error(error) if error else None,
+            "stats": stats,
+            "memory": memory.snapshot(),
+            "scan_complete": scanner.finished,
+        }
+        results.append(result)
+        result["throughput"] = throughput.snapshot(scanner.discovered - len(results))
+        if progress_callback is not None:
+            progress_callback(len(results), scanner.discovered, result)
+        return result
+
+    # path ของไฟล์ปลายทาง (normcase) -> ไฟล์ต้นฉบับที่เป็นเจ้าของ เพื่อไม่ให้ไฟล์ต่างนามสกุลที่ชื่อเดียวกัน
+    # (เช่น IMG_0001.CR2 กับ IMG_0001.dng) เขียนทับไฟล์ปลายทางของกันและกัน ไฟล์ที่แปลงไว้แล้วใน manifest เป็นเจ้าของก่อน
+    output_owners = {}
+    for source, entry in manifest.items():
+        for output in entry.get("outputs", []):
+            output_owners[os.path.normcase(os.path.join(output_folder, output))] = source
+
+    def claim_outputs(dng_file, jpg_paths):
+        """
+        จอง path ปลายทางให้ dng_file แล้วคืน None
+        ถ้ามี path ที่เป็นของไฟล์ต้นฉบับอื่นที่ยังมีอยู่ จะไม่จองและคืน (path นั้น, ไฟล์ต้นฉบับอีกไฟล์)
+        """
+        keys = [os.path.normcase(jpg_path) for jpg_path in jpg_paths]
+        for key, jpg_path in zip(keys, jpg_paths):
+            owner = output_owners.get(key)
+            if owner not in (None, dng_file) and os.path.exists(os.path.join(input_folder, owner)):
+                return jpg_path, owner
+        for key in keys:
+            output_owners[key] = dng_file
+        return None
+
+    def discover_jobs():
+        """
+        คืนงาน (dng_file, dng_path, jpg_paths, fingerprint) ทีละไฟล์ตามที่ scanner พบ
+        ไฟล์ที่ up to date ถูก record เป็น "skipped" ที่นี่เลย และคืน None เมื่อ scanner ยังไม่มีไฟล์ใหม่
+        ไฟล์ที่จะเขียนทับไฟล์ปลายทางของไฟล์ต้นฉบับอื่น (ชื่อเดียวกันแต่ต่างนามสกุล) ถูก record เป็น "failed"
+        หยุดเมื่อ stop_event ถูก set (ยกเลิกระหว่างไฟล์)
+        """
+        nonlocal attempted
+        nonlocal unsaved, last_saved
+        for relative_path in scanner:
+            if stop_event.is_set():
+                return
+            if relative_path is None:
+                if watch and unsaved:
+                    # ไม่มีไฟล์ใหม่เข้ามา: บันทึก manifest ไว้ก่อน เพราะการเฝ้าโฟลเดอร์อาจรันอีกนาน
+                    save_manifest(output_folder, manifest)
+                    unsaved = 0
+                    last_saved = time.monotonic()
+                yield None
+                continue
+            # key ของ manifest ใช้ / เสมอ ไฟล์ที่อยู่บนสุดจึงมี key เป็นชื่อไฟล์เหมือนเดิม
+            dng_file = relative_path.replace(os.sep, '/')
+            dng_path = os.path.join(input_folder, relative_path)
+            jpg_paths = rendition_output_paths(output_folder, relative_path, renditions, backend.extension)
+            try:
+                fingerprint = source_fingerprint(dng_path)
+            except OSError as e: # ไฟล์ถูกลบหรือย้ายระหว่างสแกน
+                attempted = True
+                record(dng_file, jpg_paths, "failed", e)
+                continue
+            clash = claim_outputs(dng_file, jpg_paths)
+            if clash is not None:
+                attempted = True
+                jpg_path, owner = clash
+                record(dng_file, jpg_paths, "failed",
+                       ValueError(f"{os.path.relpath(jpg_path, output_folder)} is already written from {owner}; "
+                                  f"rename one of the two files to convert both"))
+                continue
+            if is_up_to_date(manifest.get(dng_file), fingerprint, settings, jpg_paths):
+                record(dng_file, jpg_paths, "skipped")
+                continue
+            for jpg_path in jpg_paths:
+                os.makedirs(os.path.dirname(jpg_path), exist_ok=True)
+            attempted = True
+            yield dng_file, dng_path, jpg_paths, fingerprint
+
+    def job_outputs(jpg_paths):
+        return [(jpg_path, rendition["target_mpx"], rendition["quality"], rendition.get("max_bytes"))
+                for jpg_path, rendition in zip(jpg_paths, renditions)]
+
+    try:
+        if workers <= 1:
+            # Serial path: แปลงทีละไฟล์ใน thread นี้
+            for job in discover_jobs():
+                if job is None:
+                    continue
+                dng_file, dng_path, jpg_paths, fingerprint = job
+                try:
+                    stats = export_renditions(dng_path, job_outputs(jpg_paths), decode_mode, resize_mode,
+                                              output_format, subsampling)
+                except Exception as e:
+                    record(dng_file, jpg_paths, "failed", e)
+                    continue
+                record(dng_file, jpg_paths, "converted", fingerprint=fingerprint, stats=stats)
+        else:
+            # Parallel path: ส่งไฟล์เข้า process pool เท่าที่จำนวน worker และงบหน่วยความจำรับได้
+            # แล้วรับผลตามลำดับที่เสร็จ
+            budget = MemoryBudget(memory_budget_mb * 1024 * 1024)
+            futures = {}
+
+            def finish(done):
+                for future in done:
+                    dng_file, jpg_paths, fingerprint, reserved = futures.pop(future)
+                    budget.release(reserved)
+                    if future.cancelled():
+                        continue
+                    try:
+                        job_result = future.result()
+                    except BaseException as e: # รวม KeyboardInterrupt/SystemExit ที่ส่งกลับมาจาก worker
+                        record(dng_file, jpg_paths, "failed", e)
+                        continue
+                    memory.update_worker(job_result["pid"], job_result["current_rss"], job_result["peak_rss"])
+                    record(dng_file, jpg_paths, "converted", fingerprint=fingerprint, stats=job_result["stats"])
+
+            def start_executor():
+                limit_worker_threads(workers)
+                # ใช้ spawn เสมอ: rawpy (LibRaw + OpenMP) อาจ deadlock ใน process ที่สร้างด้วย fork บน Linux
+                return concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                              mp_context=multiprocessing.get_context("spawn"),
+                                                              initializer=init_worker)
+
+            # pool ถูกสร้างเมื่อพบไฟล์แรกที่ต้องแปลงจริงเท่านั้น
+            executor = None
+            try:
+                for job in discover_jobs():
+                    if job is None:
+                        # scanner ยังไม่พบไฟล์ใหม่: เก็บผลของงานที่เสร็จแล้วระหว่างรอ
+                        finish([future for future in futures if future.done()])
+                        continue
+                    dng_file, dng_path, jpg_paths, fingerprint = job
+                    outputs = job_outputs(jpg_paths)
+                    try:
+                        estimate = estimate_peak_memory(dng_path, largest_target(outputs), decode_mode)
+                    except OSError as e: # ไฟล์ถูกลบหรือย้ายหลังสแกน (เช่นลบไฟล์ reject ระหว่าง watch)
+                        record(dng_file, jpg_paths, "failed", e)
+                        continue
+                    # รอจนกว่าจะมี worker ว่างและงบหน่วยความจำพอสำหรับไฟล์นี้
+                    while futures and (len(futures) >= workers or not budget.fits(estimate)):
+                        done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                        finish(done)
+                    if stop_event.is_set():
+                        break
+                    budget.acquire(estimate)
+
+                    if executor is None:
+                        executor = start_executor()
+                    job_args = (run_conversion_job, dng_path, outputs, decode_mode, resize_mode, output_format,
+                                subsampling)
+                    try:
+                        future = executor.submit(*job_args)
+                    except concurrent.futures.BrokenExecutor:
+                        # worker ตายกลางคัน (เช่น LibRaw crash กับไฟล์เสีย): ไฟล์ที่ค้างอยู่ใน pool เดิมจะได้ผลเป็น
+                        # "failed" (ลองใหม่ได้ทีหลัง) แล้วเริ่ม pool ใหม่เพื่อแปลงไฟล์ที่เหลือต่อ
+                        executor.shutdown(wait=False)
+                        memory.forget_workers()
+                        executor = start_executor()
+                        future = executor.submit(*job_args)
+                    futures[future] = (dng_file, jpg_paths, fingerprint, estimate)
+
+                if stop_event.is_set():
+                    # ยกเลิก: ไฟล์ที่ยังไม่เริ่มถูกยกเลิก ส่วนไฟล์ที่กำลังแปลงอยู่ให้เสร็จก่อน
+                    for future in futures:
+                        future.cancel()
+
+                while futures:
+                    done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                    finish(done)
+            finally:
+                if executor is not None:
+                    executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        scanner.stop()
+        # บันทึก manifest เสมอ แม้จะหยุดกลางคัน เพื่อให้รอบถัดไปทำต่อจากจุดเดิมได้
+        if attempted:
+            save_manifest(output_folder, manifest)
+
+    total_files = scanner.discovered
+
+    def count(status):
+        return sum(1 for r in results if r["status"] == status)
+
+    # เวลารวมของแต่ละ stage ทุกไฟล์ (รวมเวลาของทุก worker) เพื่อดูว่าขั้นตอนไหนกินเวลามากที่สุด
+    stage_totals = {stage: 0.0 for stage in STAGES}
+    for result in results:
+        for stage, seconds in ((result.get("stats") or {}).get("stages") or {}).items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+
+    summary = {
+        "input_folder": input_folder,
+        "output_folder": output_folder,
+        "target_mpx": target_mpx_value,
+        "quality": jpg_quality,
+        "max_bytes": max_bytes,
+        "decode_mode": decode_mode,
+        "resize_mode": resize_mode,
+        "output_format": output_format,
+        "subsampling": subsampling,
+        "renditions": renditions,
+        "workers": workers,
+        "memory_budget_mb": memory_budget_mb,
+        "extensions": list(extensions),
+        "recursive": recursive,
+        "watch": watch,
+        "cancelled": stop_event.is_set() and not watch,
+        "scan_complete": scanner.finished,
+        "total": total_files,
+        "converted": count("converted"),
+        "skipped": count("skipped"),
+        "failed": count("failed"),
+        "not_processed": total_files - len(results),
+        "failed_files": [r["source"] for r in results if r["status"] == "failed"],
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+        "memory": memory.snapshot(),
+        "throughput": throughput.snapshot(0),
+        "stage_totals": {stage: round(seconds, 6) for stage, seconds in stage_totals.items()},
+        "files": results,
+    }
+    if stats_log:
+        write_stats_log(summary, stats_log)
+    return summary
@@ -0,0 +1,139 @@
+"""
+Command line entry point สำหรับแปลงไฟล์ DNG เป็น JPG แบบ headless (ไม่ต้องมีจอ/tkinter)
+
+ตัวอย่าง:
+    python dng_converter_cli.py INPUT_DIR OUTPUT_DIR --mpx "4 MPX" --quality 90 --workers 8
+
+เมื่อจบจะพิมพ์สรุปผลเป็น JSON ออกทาง stdout ส่วนข้อความความคืบหน้าจะออกทาง stderr
+ถ้าใช้ --watch จะเฝ้าโฟลเดอร์ต่อจนกว่าจะกด Ctrl+C แล้วจึงพิมพ์สรุปผล
+ไฟล์ที่แปลงไม่สำเร็จไม่หยุด batch แต่จะอยู่ใน "failed_files" ของสรุปผล รันคำสั่งเดิมซ้ำเพื่อลองแปลงเฉพาะไฟล์เหล่านั้นใหม่
+"""
+import argparse
+import json
+import logging
+import signal
+import sys
+import threading
+
+from dng_converter import (MPX_OPTIONS, DEFAULT_WORKERS, DECODE_MODES, DEFAULT_DECODE_MODE, RESIZE_MODES,
+                           DEFAULT_RESIZE_MODE, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT, CHROMA_SUBSAMPLINGS,
+                           DEFAULT_SUBSAMPLING, DEFAULT_MEMORY_BUDGET_MB, DEFAULT_EXTENSIONS, convert_dng_to_jpg,
+                           parse_extensions, parse_file_size, parse_rendition, format_memory, format_throughput)
+
+
+def rendition_argument(text):
+    try:
+        return parse_rendition(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def file_size_argument(text):
+    try:
+        return parse_file_size(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Convert DNG raw files to JPG (or WebP, HEIF, AVIF).")
+    parser.add_argument("input_folder", help="Folder containing .dng files (subfolders are included)")
+    parser.add_argument("output_folder", help="Folder to write the converted files to (created if missing)")
+    parser.add_argument("--mpx", default="Original", choices=list(MPX_OPTIONS.keys()),
+                        help="Output size preset (default: %(default)s)")
+    parser.add_argument("--resize", default=DEFAULT_RESIZE_MODE, choices=list(RESIZE_MODES.values()),
+                        help="Resize mode: lanczos = full LANCZOS filter, balanced = fast integer box reduction "
+                             "followed by a final LANCZOS pass, fast = more box reduction for large size ratios "
+                             "(default: %(default)s)")
+    parser.add_argument("--quality", type=int, default=90, choices=range(1, 101), metavar="1-100",
+                        help="JPG quality (default: %(default)s)")
+    parser.add_argument("--format", dest="output_format", default=DEFAULT_OUTPUT_FORMAT,
+                        choices=list(OUTPUT_FORMATS.values()),
+                        help="Output format: jpeg = baseline JPEG, jpeg_progressive = progressive JPEG with optimized "
+                             "Huffman tables, webp, heif (needs pillow_heif) or avif (needs Pillow with AVIF support). "
+                             "--quality uses the JPEG scale for every format (default: %(default)s)")
+    parser.add_argument("--subsampling", default=DEFAULT_SUBSAMPLING, choices=CHROMA_SUBSAMPLINGS,
+                        help="Chroma subsampling for JPEG, HEIF and AVIF; lossy WebP is always 4:2:0 "
+                             "(default: %(default)s)")
+    parser.add_argument("--max-size", type=file_size_argument, metavar="SIZE",
+                        help="Largest output file size, e.g. 2MB or 500KB (1 MB = 1000 KB = 1000000 bytes). "
+                             "Each file is saved with the highest quality up to --quality that fits")
+    parser.add_argument("--rendition", dest="renditions", action="append", type=rendition_argument,
+                        metavar="PRESET:QUALITY[:SUFFIX[:SUBFOLDER]]",
+                        help="Write this rendition from the same decode; repeat for several outputs per raw file, "
+                             "e.g. --rendition Original:95::archive --rendition \"12 MPX:90:_print\" "
+                             "--rendition 2:2MB:_web:web. QUALITY is 1-100 or a largest file size such as 2MB. "
+                             "Replaces --mpx, --quality and --max-size")
+    parser.add_argument("--decode", default=DEFAULT_DECODE_MODE, choices=list(DECODE_MODES.values()),
+                        help="Raw decode mode: full = always full-resolution demosaic, auto = half-size decode "
+                             "when the output is at most 1/4 of the sensor area, fast = auto plus a cheaper "
+                             "demosaic otherwise, preview = use the embedded JPEG preview when it is large enough "
+                             "(default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Number of worker processes (default: %(default)s)")
+    parser.add_argument("--memory-budget", type=int, default=DEFAULT_MEMORY_BUDGET_MB, metavar="MB",
+                        help="Only run as many conversions at once as fit in this much memory, "
+                             "0 = no limit (default: %(default)s)")
+    parser.add_argument("--extensions", type=parse_extensions, default=DEFAULT_EXTENSIONS, metavar="EXT[,EXT...]",
+                        help="Raw file extensions to convert, e.g. dng,cr2,nef,arw (default: dng)")
+    parser.add_argument("--no-recursive", dest="recursive", action="store_false",
+                        help="Only convert files directly inside the input folder, not in subfolders")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep watching the input folder after the existing files are done and convert new "
+                             "files as soon as they finish copying; press Ctrl+C to stop")
+    parser.add_argument("--force", action="store_true",
+                        help="Reconvert every file, ignoring the manifest in the output folder")
+    parser.add_argument("--log", metavar="PATH",
+                        help="Write per-file stage timings, bytes and pixel counts to PATH "
+                             "(.csv for one row per file, otherwise JSON)")
+    parser.add_argument("--quiet", action="store_true", help="Don't print per-file progress to stderr")
+    parser.add_argument("--verbose", action="store_true", help="Print debug logging to stderr")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+
+    def on_progress(done, total, result):
+        if args.quiet:
+            return
+        total_text = f"{total}" if result["scan_complete"] else f"{total}+" # ยังสแกนไม่เสร็จ
+        line = (f"[{done}/{total_text}] {result['status']}: {result['source']} - "
+                f"{format_throughput(result['throughput'])} - {format_memory(result['memory'])}")
+        if result["error"]:
+            line += f" ({result['error']})"
+        print(line, file=sys.stderr, flush=True)
+
+    # Ctrl+C ครั้งแรก: ไม่เริ่มไฟล์ใหม่ รอไฟล์ที่กำลังแปลงให้เสร็จแล้วพิมพ์สรุปผล ครั้งที่สองจึงหยุดทันที
+    stop_event = threading.Event()
+
+    def on_interrupt(signum, frame):
+        stop_event.set()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        print("Stopping after the files in progress...", file=sys.stderr, flush=True)
+
+    signal.signal(signal.SIGINT, on_interrupt)
+    if args.watch:
+        print(f"Watching {args.input_folder} for new files... press Ctrl+C to stop", file=sys.stderr, flush=True)
+
+    try:
+        summary = convert_dng_to_jpg(args.input_folder, args.output_folder, MPX_OPTIONS[args.mpx], args.quality,
+                                     workers=max(1, args.workers), progress_callback=on_progress,
+                                     force=args.force, decode_mode=args.decode,
+                                     memory_budget_mb=max(0, args.memory_budget), stats_log=args.log,
+                                     extensions=args.extensions, recursive=args.recursive,
+                                     renditions=args.renditions, resize_mode=args.resize,
+                                     max_bytes=args.max_size, output_format=args.output_format,
+                                     subsampling=args.subsampling, watch=args.watch, stop_event=stop_event)
+    except Exception as e:
+        print(json.dumps({"error": str(e)}), flush=True)
+        return 2
+
+    print(json.dumps(summary, indent=2), flush=True)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,420 +1,472 @@
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
 import os
-import rawpy
-from PIL import Image, ExifTags
+import time
+import queue
 import threading
-import math
-import piexif
-import exifread
-
-# กำหนดค่า MPX ที่เลือกได้
-MPX_OPTIONS = {
-    "Original": None, # ใช้ None เพื่อระบุว่าให้คงขนาดเดิม
-    "2 MPX": 2_000_000,
-    "4 MPX": 4_000_000,
-    "6 MPX": 6_000_000,
-    "8 MPX": 8_000_000,
-    "10 MPX": 10_000_000,
-    "12 MPX": 12_000_000,
-    "14 MPX": 14_000_000,
-    "16 MPX": 16_000_000
-}
-
-# Dictionary to map exifread tag names to piexif tag IDs and their IFD
-# This is a partial mapping, you might need to extend it for all possible tags
-# that exifread can find and you want to preserve.
-# For complex tags like GPS, we will handle them specifically.
-EXIFREAD_TO_PIEXIF_MAP = {
-    # 0th IFD (Image IFD)
-    'Image Make': (piexif.ImageIFD.Make, 'bytes'),
-    'Image Model': (piexif.ImageIFD.Model, 'bytes'),
-    'Image Orientation': (piexif.ImageIFD.Orientation, 'int'),
-    'Image Artist': (piexif.ImageIFD.Artist, 'bytes'),
-    'Image Copyright': (piexif.ImageIFD.Copyright, 'bytes'),
-    'Image Software': (piexif.ImageIFD.Software, 'bytes'),
-    'Image DateTime': (piexif.ImageIFD.DateTime, 'bytes'), # Date and time of image creation
-
-    # Exif IFD
-    'EXIF ExposureTime': (piexif.ExifIFD.ExposureTime, 'rational'),
-    'EXIF FNumber': (piexif.ExifIFD.FNumber, 'rational'),
-    'EXIF ExposureProgram': (piexif.ExifIFD.ExposureProgram, 'int'),
-    'EXIF ISOSpeedRatings': (piexif.ExifIFD.ISOSpeedRatings, 'int'),
-    'EXIF SensitivityType': (piexif.ExifIFD.SensitivityType, 'int'), # Added from your image
-    'EXIF RecommendedExposureIndex': (piexif.ExifIFD.RecommendedExposureIndex, 'long'), # Added
-    'EXIF ExifVersion': (piexif.ExifIFD.ExifVersion, 'bytes'), # Added
-    'EXIF DateTimeOriginal': (piexif.ExifIFD.DateTimeOriginal, 'bytes'),
-    'EXIF DateTimeDigitized': (piexif.ExifIFD.DateTimeDigitized, 'bytes'),
-    'EXIF ShutterSpeedValue': (piexif.ExifIFD.ShutterSpeedValue, 's_rational'), # Signed Rational
-    'EXIF ApertureValue': (piexif.ExifIFD.ApertureValue, 'rational'),
-    'EXIF ExposureBiasValue': (piexif.ExifIFD.ExposureBiasValue, 's_rational'), # Signed Rational
-    'EXIF MaxApertureValue': (piexif.ExifIFD.MaxApertureValue, 'rational'),
-    'EXIF MeteringMode': (piexif.ExifIFD.MeteringMode, 'int'),
-    'EXIF Flash': (piexif.ExifIFD.Flash, 'int'),
-    'EXIF FocalLength': (piexif.ExifIFD.FocalLength, 'rational'),
-    'EXIF SubSecTimeOriginal': (piexif.ExifIFD.SubSecTimeOriginal, 'bytes'), # Added
-    'EXIF SubSecTimeDigitized': (piexif.ExifIFD.SubSecTimeDigitized, 'bytes'), # Added
-    'EXIF ColorSpace': (piexif.ExifIFD.ColorSpace, 'int'), # Added
-    'EXIF FocalPlaneXResolution': (piexif.ExifIFD.FocalPlaneXResolution, 'rational'), # Added
-    'EXIF FocalPlaneYResolution': (piexif.ExifIFD.FocalPlaneYResolution, 'rational'), # Added
-    'EXIF FocalPlaneResolutionUnit': (piexif.ExifIFD.FocalPlaneResolutionUnit, 'int'), # Added
-    'EXIF CustomRendered': (piexif.ExifIFD.CustomRendered, 'int'), # Added
-    'EXIF ExposureMode': (piexif.ExifIFD.ExposureMode, 'int'), # Added
-    'EXIF WhiteBalance': (piexif.ExifIFD.WhiteBalance, 'int'), # Added (note: also in 0th sometimes)
-    'EXIF SceneCaptureType': (piexif.ExifIFD.SceneCaptureType, 'int'), # Added
-    'EXIF BodySerialNumber': (piexif.ExifIFD.BodySerialNumber, 'bytes'), # Added
-    'EXIF LensSpecification': (piexif.ExifIFD.LensSpecification, 'rational_list'), # Added, this is a list of rationals
-    'EXIF LensModel': (piexif.ExifIFD.LensModel, 'bytes'), # Added
-    'EXIF LensSerialNumber': (piexif.ExifIFD.LensSerialNumber, 'bytes'), # Added
-    'EXIF ComponentsConfiguration': (piexif.ExifIFD.ComponentsConfiguration, 'bytes'),
-    'EXIF FlashpixVersion': (piexif.ExifIFD.FlashpixVersion, 'bytes'),
-    'EXIF PixelXDimension': (piexif.ExifIFD.PixelXDimension, 'int'),
-    'EXIF PixelYDimension': (piexif.ExifIFD.PixelYDimension, 'int'),
-    'EXIF SceneType': (piexif.ExifIFD.SceneType, 'bytes'), # Undefined type often maps to bytes
-    'EXIF DigitalZoomRatio': (piexif.ExifIFD.DigitalZoomRatio, 'rational'),
-    'EXIF FNumber': (piexif.ExifIFD.FNumber, 'rational'),
-    # ... add more EXIF tags as needed from your exifread output
-}
-
-# Mapping for GPS tags (GPSIFD)
-GPS_TAGS_MAP = {
-    'GPS GPSVersionID': (piexif.GPSIFD.GPSVersionID, 'bytes_list'), # list of bytes (4 bytes)
-    'GPS GPSLatitudeRef': (piexif.GPSIFD.GPSLatitudeRef, 'bytes'),
-    'GPS GPSLatitude': (piexif.GPSIFD.GPSLatitude, 'rational_list'),
-    'GPS GPSLongitudeRef': (piexif.GPSIFD.GPSLongitudeRef, 'bytes'),
-    'GPS GPSLongitude': (piexif.GPSIFD.GPSLongitude, 'rational_list'),
-    'GPS GPSAltitudeRef': (piexif.GPSIFD.GPSAltitudeRef, 'int'),
-    'GPS GPSAltitude': (piexif.GPSIFD.GPSAltitude, 'rational'),
-    'GPS GPSTimeStamp': (piexif.GPSIFD.GPSTimeStamp, 'rational_list'),
-    'GPS GPSDate': (piexif.GPSIFD.GPSDateStamp, 'bytes'),
-    'GPS GPSStatus': (piexif.GPSIFD.GPSStatus, 'bytes'),
-    'GPS GPSMeasureMode': (piexif.GPSIFD.GPSMeasureMode, 'bytes'),
-    'GPS GPSSpeedRef': (piexif.GPSIFD.GPSSpeedRef, 'bytes'),
-    'GPS GPSSpeed': (piexif.GPSIFD.GPSSpeed, 'rational'),
-    'GPS GPSTrackRef': (piexif.GPSIFD.GPSTrackRef, 'bytes'),
-    'GPS GPSTrack': (piexif.GPSIFD.GPSTrack, 'rational'),
-    'GPS GPSImgDirectionRef': (piexif.GPSIFD.GPSImgDirectionRef, 'bytes'),
-    'GPS GPSImgDirection': (piexif.GPSIFD.GPSImgDirection, 'rational'),
-    'GPS GPSMapDatum': (piexif.GPSIFD.GPSMapDatum, 'bytes'),
-    'GPS GPSDestLatitudeRef': (piexif.GPSIFD.GPSDestLatitudeRef, 'bytes'),
-    'GPS GPSDestLatitude': (piexif.GPSIFD.GPSDestLatitude, 'rational_list'),
-    'GPS GPSDestLongitudeRef': (piexif.GPSIFD.GPSDestLongitudeRef, 'bytes'),
-    'GPS GPSDestLongitude': (piexif.GPSIFD.GPSDestLongitude, 'rational_list'),
-    'GPS GPSDestBearingRef': (piexif.GPSIFD.GPSDestBearingRef, 'bytes'),
-    'GPS GPSDestBearing': (piexif.GPSIFD.GPSDestBearing, 'rational'),
-    'GPS GPSDestDistanceRef': (piexif.GPSIFD.GPSDestDistanceRef, 'bytes'),
-    'GPS GPSDestDistance': (piexif.GPSIFD.GPSDestDistance, 'rational'),
-    # ... add more GPS tags
-}
-
-
-def get_piexif_ifd(exifread_tag_name):
-    """Determines which piexif IFD a tag belongs to based on its name."""
-    if exifread_tag_name.startswith('GPS'):
-        return "GPS"
-    elif exifread_tag_name.startswith('EXIF'):
-        return "Exif"
-    elif exifread_tag_name.startswith('Image'):
-        return "0th"
-    # You might need to add logic for "Interop" or "1st" IFD if necessary
-    return None # Unknown IFD
-
-
-def convert_exifread_value_to_piexif_format(exifread_tag_obj, data_type):
-    """
-    Converts exifread Tag object value to piexif compatible format.
-    Handles common data types.
-    """
-    if exifread_tag_obj is None:
-        return None
-
-    if data_type == 'bytes':
-        return str(exifread_tag_obj).encode('utf-8')
-    elif data_type == 'int':
-        return exifread_tag_obj.values[0]
-    elif data_type == 'long': # For Long type which exifread also gives as int
-        return exifread_tag_obj.values[0]
-    elif data_type == 'rational':
-        val = exifread_tag_obj.values[0]
-        return (val.num, val.den)
-    elif data_type == 's_rational': # Signed Rational
-        val = exifread_tag_obj.values[0]
-        # exifread.Rational handles negative num/den itself. piexif also needs (num, den)
-        return (val.num, val.den)
-    elif data_type == 'rational_list':
-        # For tags like GPS Latitude/Longitude, which are list of rationals
-        return [(val.num, val.den) for val in exifread_tag_obj.values]
-    elif data_type == 'bytes_list': # For GPSVersionID which is a list of bytes/ints
-        return tuple(exifread_tag_obj.values) # Convert list of ints to tuple of ints
-    # Add more type handling if needed (e.g., undefined, ASCII lists, etc.)
-    return None # Return None for unsupported types
-
-
-def copy_exif_data(source_path, target_image):
-    """
-    คัดลอกข้อมูล EXIF ทั้งหมดจากไฟล์ต้นฉบับ (DNG หรือ JPG) ไปยังอ็อบเจกต์ Image ของ Pillow
-    โดยใช้ exifread ในการอ่าน และ piexif ในการสร้างและบันทึก
-    """
-    exif_bytes_to_save = None
-    piexif_exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "Interop": {}, "1st": {}}
-
-    try:
-        # 1. อ่าน EXIF ด้วย exifread
-        with open(source_path, 'rb') as f:
-            tags = exifread.process_file(f, details=False) 
-        
-        print(f"Successfully loaded EXIF with exifread from {source_path}")
-        
-        # 2. วนลูปผ่านทุก Tag ที่ exifread ดึงมาได้
-        for tag_name, tag_obj in tags.items():
-            if tag_name in EXIFREAD_TO_PIEXIF_MAP:
-                piexif_id, data_type = EXIFREAD_TO_PIEXIF_MAP[tag_name]
-                ifd_name = get_piexif_ifd(tag_name)
-                
-                if ifd_name:
-                    converted_value = convert_exifread_value_to_piexif_format(tag_obj, data_type)
-                    if converted_value is not None:
-                        piexif_exif_dict[ifd_name][piexif_id] = converted_value
-                        # print(f"  Copied: {tag_name} ({ifd_name}) -> {converted_value}")
-                else:
-                    print(f"  Warning: Could not determine IFD for {tag_name}")
-            elif tag_name in GPS_TAGS_MAP: # Handle GPS tags separately
-                piexif_id, data_type = GPS_TAGS_MAP[tag_name]
-                ifd_name = "GPS"
-                converted_value = convert_exifread_value_to_piexif_format(tag_obj, data_type)
-                if converted_value is not None:
-                    piexif_exif_dict[ifd_name][piexif_id] = converted_value
-                    # print(f"  Copied GPS: {tag_name} ({ifd_name}) -> {converted_value}")
-            else:
-                # print(f"  Skipping unsupported or unmapped EXIF tag: {tag_name}")
-                pass # You can remove this or uncomment for debugging
-
-        # 3. แปลง piexif_exif_dict กลับเป็น bytes เพื่อบันทึก
-        if any(piexif_exif_dict[ifd] for ifd in piexif_exif_dict):
-            # Clean up potentially empty IFDs before dumping, as piexif might complain
-            # (though piexif.dump usually handles empty IFDs gracefully if they are empty dicts)
-            
-            exif_bytes_to_save = piexif.dump(piexif_exif_dict)
-            print(f"EXIF data successfully dumped to bytes.")
-        else:
-            print("No relevant EXIF data found by exifread to copy or empty EXIF dict.")
+import multiprocessing
+from dng_converter import (MPX_OPTIONS, DEFAULT_WORKERS, DECODE_MODES, RESIZE_MODES, OUTPUT_FORMATS, CHROMA_SUBSAMPLINGS,
+                           DEFAULT_SUBSAMPLING, DEFAULT_MEMORY_BUDGET_MB, STATS_LOG_FOLDER, available_output_formats,
+                           convert_dng_to_jpg, format_memory, format_throughput, parse_extensions, parse_file_size,
+                           parse_renditions)
 
-    except exifread.exceptions.InvalidExifError:
-        print(f"No valid EXIF data found in {source_path} using exifread.")
-    except Exception as e_read:
-        print(f"Error processing EXIF with exifread/piexif for {source_path}: {e_read}")
-
-    # 4. กำหนด exif bytes ให้กับอ็อบเจกต์ Image ของ Pillow
-    if exif_bytes_to_save:
-        target_image.info['exif'] = exif_bytes_to_save
-        print(f"EXIF bytes assigned to target image for saving.")
-    else:
-        if 'exif' in target_image.info:
-            del target_image.info['exif']
-        print(f"No EXIF data will be copied for {source_path}.")
+# ความถี่ที่ Tk loop อ่าน event จาก thread ที่แปลงไฟล์ (ms) ถ้ามีหลาย event ในช่วงนี้จะแสดงเฉพาะอันล่าสุด
+EVENT_DRAIN_INTERVAL_MS = 200
 
 
-def calculate_new_dimensions(original_width, original_height, target_mpx):
+def run_conversion(input_folder, output_folder, target_mpx_value, jpg_quality, events, **options):
     """
-    คำนวณขนาดใหม่ (width, height) เพื่อให้ได้จำนวนพิกเซลใกล้เคียง target_mpx
-    โดยรักษาสัดส่วนภาพเดิม
+    เรียก convert_dng_to_jpg ของไลบรารีใน thread แยก แล้วส่งความคืบหน้าเข้าคิว events
+    thread นี้ไม่แตะ widget ของ Tk เลย (Tk ไม่ thread-safe) drain_events ใน Tk loop เป็นผู้อัปเดต GUI
+    options คือ keyword arguments อื่นๆ ของ convert_dng_to_jpg (workers, force, decode_mode, ...)
     """
-    if target_mpx is None: # Original size
-        return original_width, original_height
-
-    original_mpx = original_width * original_height
-    
-    if original_mpx <= target_mpx: # ถ้าภาพต้นฉบับเล็กกว่าหรือเท่ากับขนาดที่ต้องการ
-        return original_width, original_height # ไม่ต้องขยายภาพ
+    def on_progress(done, total, result):
+        events.put(("progress", done, total, result))
 
-    aspect_ratio = original_width / original_height
-    
-    # คำนวณความสูงใหม่จาก target_mpx และ aspect_ratio
-    new_height = int(math.sqrt(target_mpx / aspect_ratio))
-    new_width = int(new_height * aspect_ratio)
+    try:
+        summary = convert_dng_to_jpg(input_folder, output_folder, target_mpx_value, jpg_quality,
+                                     progress_callback=on_progress, **options)
+    except Exception as e:
+        events.put(("error", str(e)))
+        return
+    events.put(("finished", summary))
 
-    return new_width, new_height
 
-def convert_dng_to_jpg(input_folder, output_folder, target_mpx_value, jpg_quality, progress_var, status_label):
+def parse_max_size(text):
     """
-    ฟังก์ชันหลักสำหรับแปลงไฟล์ DNG เป็น JPG พร้อมปรับขนาดและคุณภาพ
+    ค่าในช่อง Max File Size เป็น bytes: ตัวเลขล้วนคือ KB, มีหน่วยได้เช่น "2MB" (เหมือน --max-size)
+    ว่างหรือ 0 = ไม่จำกัด (None) แจ้ง ValueError ถ้าอ่านไม่ได้
     """
-    if not os.path.exists(input_folder):
-        messagebox.showerror("Error", "Input folder does not exist.")
-        return
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    dng_files = [f for f in os.listdir(input_folder) if f.lower().endswith('.dng')]
-    total_files = len(dng_files)
-    if total_files == 0:
-        status_label.config(text="No .dng files found in the input folder.")
-        progress_var.set(100) # Complete the progress bar if no files
-        return
+    text = text.strip()
+    if not text:
+        return None
+    try:
+        kilobytes = float(text)
+    except ValueError:
+        return parse_file_size(text) # มีหน่วย เช่น 2MB หรือ 500KB
+    return parse_file_size(f"{text}KB") if kilobytes else None
 
-    progress_var.set(0) # Reset progress
-    
-    for i, dng_file in enumerate(dng_files):
-        dng_path = os.path.join(input_folder, dng_file)
-        jpg_filename = os.path.splitext(dng_file)[0] + '.jpg'
-        jpg_path = os.path.join(output_folder, jpg_filename)
 
-        status_label.config(text=f"Converting: {dng_file} ({i+1}/{total_files})")
-        
-        try:
-            with rawpy.imread(dng_path) as raw:
-                rgb = raw.postprocess(
-                    use_camera_wb=True,
-                    output_color=rawpy.ColorSpace.sRGB,
-                    no_auto_bright=True
-                )
-                
-                image = Image.fromarray(rgb)
-                
-                # คัดลอก EXIF data ก่อนปรับขนาด
-                # ตรงนี้จะเรียก copy_exif_data และมันจะจัดการใส่ EXIF bytes ลงใน image.info['exif'] ให้เอง
-                copy_exif_data(dng_path, image)
-              
-                # ปรับขนาดภาพตาม MPX ที่เลือก
-                if target_mpx_value is not None:
-                    original_width, original_height = image.size
-                    new_width, new_height = calculate_new_dimensions(original_width, original_height, target_mpx_value)
-                    
-                    if (new_width, new_height) != (original_width, original_height):
-                        image = image.resize((new_width, new_height), Image.LANCZOS) # ใช้ LANCZOS เพื่อคุณภาพดีที่สุดในการลดขนาด
-
-                # บันทึกเป็น JPG ด้วยคุณภาพที่กำหนด
-                image.save(jpg_path, quality=jpg_quality, subsampling=0, exif=image.info.get('exif')) # subsampling=0 เพื่อคุณภาพสูงสุด
-
-            # อัปเดต Progress Bar
-            progress = (i + 1) / total_files * 100
-            progress_var.set(progress)
-            
-        except Exception as e:
-            messagebox.showerror("Conversion Error", f"Failed to convert {dng_file}: {e}")
-            status_label.config(text=f"Error converting {dng_file}")
-            break
-    
-    status_label.config(text="Conversion complete!")
-    messagebox.showinfo("Done", "All DNG files converted to JPG!")
+def new_stats_log(output_folder):
+    """log ผลการวัดของรอบใหม่ (เวลาแต่ละขั้นตอนของทุกไฟล์) เก็บไว้ในโฟลเดอร์ปลายทาง"""
+    return os.path.join(output_folder, STATS_LOG_FOLDER, time.strftime("run-%Y%m%d-%H%M%S.csv"))
 
 
-def start_conversion_thread(input_folder_path, output_folder_path, selected_mpx_option, selected_quality, progress_var, status_label):
+def start_conversion_thread(variables, progress_var, status_label, throughput_label):
     """
     เริ่มกระบวนการแปลงไฟล์ใน Thread แยกต่างหาก เพื่อไม่ให้ GUI ค้าง
+    variables คือ dict ของตัวแปร Tk ของทุกตัวเลือก (ดู variables ใน GUI Setup)
     """
+    input_folder_path = variables["input_folder"]
+    output_folder_path = variables["output_folder"]
     if not input_folder_path.get() or not output_folder_path.get():
         messagebox.showwarning("Warning", "Please select both input and output folders.")
         return
         
     # ดึงค่า MPX จริงจากที่เลือก
-    target_mpx = MPX_OPTIONS[selected_mpx_option.get()]
-    jpg_quality = selected_quality.get() # ดึงค่าจาก tk.IntVar() ซึ่งเป็น Integer อยู่แล้ว
+    target_mpx = MPX_OPTIONS[variables["mpx"].get()]
+    jpg_quality = variables["quality"].get() # ดึงค่าจาก tk.IntVar() ซึ่งเป็น Integer อยู่แล้ว
+    try:
+        renditions = parse_renditions(variables["renditions"].get()) # ว่าง = ใช้ Output MPX และ JPG Quality
+    except ValueError as e:
+        messagebox.showwarning("Warning", str(e))
+        return
+    try:
+        max_bytes = parse_max_size(variables["max_size"].get())
+    except ValueError as e:
+        messagebox.showwarning("Warning", f"Max File Size: {e}")
+        return
+    try:
+        memory_budget_mb = variables["memory_budget"].get() # Spinbox พิมพ์ได้ จึงอาจว่างหรือไม่ใช่ตัวเลข
+    except tk.TclError:
+        messagebox.showwarning("Warning", "Memory Budget must be a whole number of MB (0 = no limit).")
+        return
+    options = {
+        "workers": max(1, variables["workers"].get()),
+        "force": not variables["skip_converted"].get(),
+        "decode_mode": DECODE_MODES[variables["decode_mode"].get()],
+        "resize_mode": RESIZE_MODES[variables["resize_mode"].get()],
+        "memory_budget_mb": max(0, memory_budget_mb),
+        "extensions": parse_extensions(variables["extensions"].get()),
+        "recursive": variables["include_subfolders"].get(),
+        "renditions": renditions or None,
+        "max_bytes": max_bytes,
+        "output_format": OUTPUT_FORMATS[variables["output_format"].get()],
+        "subsampling": variables["subsampling"].get(),
+        "watch": variables["watch"].get(),
+    }
+    start_run({
+        "input_folder": input_folder_path.get(),
+        "output_folder": output_folder_path.get(),
+        "target_mpx": target_mpx,
+        "quality": jpg_quality,
+        "options": options,
+        "progress_var": progress_var,
+        "status_label": status_label,
+        "throughput_label": throughput_label,
+    })
+
+
+def start_run(run):
+    """
+    เริ่ม thread แปลงไฟล์ตามค่าใน run (dict จาก start_conversion_thread หรือ retry_failed_files)
+    แล้วให้ Tk loop อ่านคิว event ทุก EVENT_DRAIN_INTERVAL_MS
+    """
+    run["stop_event"] = threading.Event()
+    run["stats_log"] = new_stats_log(run["output_folder"])
+    run["failed"] = 0
+    options = dict(run["options"], stop_event=run["stop_event"], stats_log=run["stats_log"])
+    events = queue.Queue()
+
+    run["progress_var"].set(0) # Reset progress
+    run["throughput_label"].config(text="")
+    if options["watch"]:
+        run["status_label"].config(text=f"Watching {run['input_folder']} with {options['workers']} worker(s)...")
+    else:
+        run["status_label"].config(text=f"Converting with {options['workers']} worker(s)...")
 
     start_button.config(state=tk.DISABLED)
-    progress_bar.pack(pady=10)
-    
-    conversion_thread = threading.Thread(target=convert_dng_to_jpg, 
-                                         args=(input_folder_path.get(), 
-                                               output_folder_path.get(), 
-                                               target_mpx, 
-                                               jpg_quality,
-                                               progress_var, 
-                                               status_label))
+    progress_frame.pack(pady=10)
+    # ยกเลิกระหว่างไฟล์: ไฟล์ที่กำลังแปลงอยู่จะแปลงจนเสร็จ ไฟล์ที่เหลือจะถูกแปลงในรอบถัดไป
+    cancel_button.config(text="Stop Watching" if options["watch"] else "Cancel", state=tk.NORMAL,
+                         command=lambda: cancel_run(run))
+    cancel_button.pack(pady=5)
+
+    conversion_thread = threading.Thread(target=run_conversion,
+                                         args=(run["input_folder"],
+                                               run["output_folder"],
+                                               run["target_mpx"],
+                                               run["quality"],
+                                               events),
+                                         kwargs=options,
+                                         daemon=True)
     conversion_thread.start()
-    
-    root.after(100, check_thread_status, conversion_thread)
-
-def check_thread_status(thread):
-    if thread.is_alive():
-        root.after(100, check_thread_status, thread)
-    else:
-        start_button.config(state=tk.NORMAL)
-        progress_bar.pack_forget()
-
-# --- ฟังก์ชันสำหรับอัปเดตค่า Quality Slider ให้เป็นจำนวนเต็ม ---
-def update_quality_value(val):
-    """เมื่อ Slider ถูกเลื่อน, ปัดเศษค่าให้เป็นจำนวนเต็มและอัปเดต tk.IntVar"""
-    selected_quality.set(int(float(val)))
-
-
-# --- GUI Setup ---
-root = tk.Tk()
-root.title("DNG to JPG Converter")
-root.geometry("500x450") # เพิ่มขนาดหน้าต่าง
-root.resizable(False, False)
-
-# Variables
-input_folder_path = tk.StringVar()
-output_folder_path = tk.StringVar()
-progress_var = tk.DoubleVar()
-selected_mpx_option = tk.StringVar(value="Original") # ค่าเริ่มต้น
 
-# ใช้ tk.IntVar() สำหรับ quality เพื่อให้เป็น Integer โดยตรง
-selected_quality = tk.IntVar(value=90) # ค่าเริ่มต้น
+    root.after(EVENT_DRAIN_INTERVAL_MS, drain_events, events, run)
 
-# Input Folder Selection
-input_frame = tk.LabelFrame(root, text="Input Folder (DNG files)")
-input_frame.pack(padx=20, pady=10, fill="x")
 
-input_entry = tk.Entry(input_frame, textvariable=input_folder_path, width=50)
-input_entry.pack(side=tk.LEFT, padx=5, pady=5, expand=True, fill="x")
+def cancel_run(run):
+    run["stop_event"].set()
+    cancel_button.config(state=tk.DISABLED)
+    run["status_label"].config(text="Stopping after the files in progress...")
 
-input_button = tk.Button(input_frame, text="Browse", 
-                         command=lambda: input_folder_path.set(filedialog.askdirectory()))
-input_button.pack(side=tk.RIGHT, padx=5, pady=5)
 
-# Output Folder Selection
-output_frame = tk.LabelFrame(root, text="Output Folder (JPG files)")
-output_frame.pack(padx=20, pady=10, fill="x")
-
-output_entry = tk.Entry(output_frame, textvariable=output_folder_path, width=50)
-output_entry.pack(side=tk.LEFT, padx=5, pady=5, expand=True, fill="x")
-
-output_button = tk.Button(output_frame, text="Browse", 
-                          command=lambda: output_folder_path.set(filedialog.askdirectory()))
-output_button.pack(side=tk.RIGHT, padx=5, pady=5)
+def drain_events(events, run):
+    """อ่าน event ทั้งหมดที่ค้างในคิว แสดงเฉพาะความคืบหน้าล่าสุด แล้วนัดรอบถัดไปจนกว่า thread จะจบ"""
+    latest = None
+    while True:
+        try:
+            event = events.get_nowait()
+        except queue.Empty:
+            break
+        if event[0] != "progress":
+            # "finished"/"error" เป็น event สุดท้ายของ thread เสมอ
+            if latest is not None:
+                show_progress(run, *latest[1:])
+            finish_run(run, event)
+            return
+        if event[3]["status"] == "failed":
+            run["failed"] += 1
+        latest = event
+
+    if latest is not None:
+        show_progress(run, *latest[1:])
+    root.after(EVENT_DRAIN_INTERVAL_MS, drain_events, events, run)
+
+
+def show_progress(run, done, total, result):
+    if run["stop_event"].is_set():
+        return # คงข้อความ "Stopping..." ไว้
+    verb = {"skipped": "Skipped (up to date)", "failed": "Failed"}.get(result["status"], "Converted")
+    failed = f", {run['failed']} failed" if run["failed"] else ""
+    if result["scan_complete"]:
+        run["status_label"].config(text=f"{verb}: {result['source']} ({done}/{total}{failed})\n"
+                                        f"{format_memory(result['memory'])}")
+        run["progress_var"].set(done / total * 100)
+    else:
+        # ยังสแกนโฟลเดอร์ไม่เสร็จ (หรือกำลังเฝ้าโฟลเดอร์): total คือจำนวนไฟล์ที่พบแล้ว จึงไม่ให้ progress bar เต็ม
+        activity = "watching for new files..." if run["options"]["watch"] else "scanning..."
+        run["status_label"].config(text=f"{verb}: {result['source']} ({done}/{total}+{failed}, {activity})\n"
+                                        f"{format_memory(result['memory'])}")
+        run["progress_var"].set(min(done / total * 100, 99))
+    run["throughput_label"].config(text=format_throughput(result["throughput"]))
+
+
+def finish_run(run, event):
+    start_button.config(state=tk.NORMAL)
+    cancel_button.pack_forget()
+    progress_frame.pack_forget()
+    status_label = run["status_label"]
+
+    if event[0] == "error":
+        status_label.config(text="Ready to convert...")
+        messagebox.showerror("Error", event[1])
+        return
+    summary = event[1]
+    counts = f"{summary['converted']} converted, {summary['skipped']} up to date, {summary['failed']} failed"
+
+    if summary["watch"]:
+        status_label.config(text=f"Stopped watching. {counts}.\n{format_memory(summary['memory'])}")
+    elif summary["cancelled"]:
+        status_label.config(text=f"Cancelled. {counts}, {summary['not_processed']} not processed.\n"
+                                 f"{format_memory(summary['memory'])}")
+    elif summary["total"] == 0:
+        status_label.config(text="No matching raw files found in the input folder.")
+        run["progress_var"].set(100) # Complete the progress bar if no files
+        return
+    else:
+        status_label.config(text=f"Conversion complete! {counts}.\n{format_memory(summary['memory'])}\n"
+                                 f"Log: {run['stats_log']}")
+
+    if summary["failed"]:
+        show_failure_report(run, summary)
+    elif not summary["watch"] and not summary["cancelled"]:
+        if summary["skipped"]:
+            messagebox.showinfo("Done", f"All DNG files converted to JPG! ({summary['skipped']} already up to date)")
+        else:
+            messagebox.showinfo("Done", "All DNG files converted to JPG!")
 
-# Image Options Frame
-options_frame = tk.LabelFrame(root, text="Image Options")
-options_frame.pack(padx=20, pady=10, fill="x")
 
-# MPX Selection
-mpx_label = tk.Label(options_frame, text="Output MPX:")
-mpx_label.grid(row=0, column=0, padx=5, pady=5, sticky="w")
-mpx_dropdown = ttk.Combobox(options_frame, textvariable=selected_mpx_option, 
-                            values=list(MPX_OPTIONS.keys()), state="readonly", width=15)
-mpx_dropdown.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+def show_failure_report(run, summary):
+    """รายงานไฟล์ที่แปลงไม่สำเร็จเมื่อจบรอบ พร้อมปุ่มลองแปลงเฉพาะไฟล์เหล่านั้นใหม่"""
+    failures = [result for result in summary["files"] if result["status"] == "failed"]
+    report = tk.Toplevel(root)
+    report.title("Conversion Errors")
+    report.transient(root)
 
-# JPG Quality Slider
-quality_label = tk.Label(options_frame, text="JPG Quality (1-100):")
-quality_label.grid(row=1, column=0, padx=5, pady=5, sticky="w")
+    tk.Label(report, text=f"{len(failures)} file(s) could not be converted:").pack(padx=10, pady=(10, 5), anchor="w")
+    list_frame = tk.Frame(report)
+    list_frame.pack(padx=10, fill="both", expand=True)
+    scrollbar = tk.Scrollbar(list_frame)
+    scrollbar.pack(side="right", fill="y")
+    failure_list = tk.Listbox(list_frame, width=80, height=min(len(failures), 12), yscrollcommand=scrollbar.set)
+    failure_list.pack(side="left", fill="both", expand=True)
+    scrollbar.config(command=failure_list.yview)
+    for result in failures:
+        failure_list.insert(tk.END, f"{result['source']}: {result['error']}")
 
-# !!! การเปลี่ยนแปลงที่นี่ !!!
-# เพิ่ม command=update_quality_value เพื่อให้เรียกฟังก์ชันนี้ทุกครั้งที่ Slider ถูกเลื่อน
-quality_slider = ttk.Scale(options_frame, from_=1, to=100, orient="horizontal", 
-                           variable=selected_quality, length=200, 
-                           command=update_quality_value) # <--- เพิ่มบรรทัดนี้
-quality_slider.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
+    def retry():
+        report.destroy()
+        retry_failed_files(run, [result["source"] for result in failures])
 
-# เพิ่ม Label แสดงค่า Quality ปัจจุบัน (จะแสดงเป็น Integer อัตโนมัติเพราะผูกกับ tk.IntVar)
-quality_value_label = tk.Label(options_frame, textvariable=selected_quality)
-quality_value_label.grid(row=1, column=2, padx=5, pady=5, sticky="w")
+    button_frame = tk.Frame(report)
+    button_frame.pack(pady=10)
+    tk.Button(button_frame, text="Retry Failed Files", command=retry).pack(side="left", padx=5)
+    tk.Button(button_frame, text="Close", command=report.destroy).pack(side="left", padx=5)
 
-options_frame.grid_columnconfigure(1, weight=1) # ให้ Combobox และ Slider ขยายเต็มพื้นที่
 
-# Start Conversion Button
-start_button = tk.Button(root, text="Start Conversion", font=("Arial", 12, "bold"),
-                         command=lambda: start_conversion_thread(input_folder_path, output_folder_path, 
-                                                                 selected_mpx_option, selected_quality,
-                                                                 progress_var, status_label))
-start_button.pack(pady=15)
+def retry_failed_files(run, sources):
+    """แปลงเฉพาะไฟล์ที่ล้มเหลวใหม่ด้วยค่าตั้งเดิม (ไม่เฝ้าโฟลเดอร์ต่อ แม้รอบเดิมจะเป็นโหมด watch)"""
+    start_run(dict(run, options=dict(run["options"], files=sources, watch=False)))
 
-# Progress Bar
-progress_bar = ttk.Progressbar(root, variable=progress_var, maximum=100, length=400, mode='determinate')
+# --- ฟังก์ชันสำหรับอัปเดตค่า Quality Slider ให้เป็นจำนวนเต็ม ---
+def update_quality_value(val):
+    """เมื่อ Slider ถูกเลื่อน, ปัดเศษค่าให้เป็นจำนวนเต็มและอัปเดต tk.IntVar"""
+    selected_quality.set(int(float(val)))
 
-# Status Label
-status_label = tk.Label(root, text="Ready to convert...", font=("Arial", 10))
-status_label.pack(pady=5)
 
-root.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    # จำเป็นสำหรับ ProcessPoolExecutor เมื่อ build เป็น .exe ด้วย PyInstaller
+    multiprocessing.freeze_support()
+
+    # --- GUI Setup ---
+    root = tk.Tk()
+    root.title("DNG to JPG Converter")
+    # ไม่กำหนดความสูงตายตัว: หน้าต่างสูงเท่าเนื้อหา (ตัวเลือกแบ่งเป็นแท็บเพื่อให้พอดีจอ 768 px)
+    # และยืดเองเมื่อ progress bar / ปุ่ม Cancel แสดงขึ้นมา
+    root.minsize(500, 0)
+    root.resizable(False, False)
+
+    # Variables
+    input_folder_path = tk.StringVar()
+    output_folder_path = tk.StringVar()
+    progress_var = tk.DoubleVar()
+    selected_mpx_option = tk.StringVar(value="Original") # ค่าเริ่มต้น
+    selected_resize_mode = tk.StringVar(value="Balanced")
+
+    # ใช้ tk.IntVar() สำหรับ quality เพื่อให้เป็น Integer โดยตรง
+    selected_quality = tk.IntVar(value=90) # ค่าเริ่มต้น
+    selected_max_size = tk.StringVar(value="0") # KB หรือมีหน่วยเช่น 2MB (parse_max_size)
+    selected_output_format = tk.StringVar(value="JPEG")
+    selected_subsampling = tk.StringVar(value=DEFAULT_SUBSAMPLING)
+    selected_renditions = tk.StringVar()
+    selected_workers = tk.IntVar(value=DEFAULT_WORKERS)
+    skip_converted = tk.BooleanVar(value=True)
+    selected_decode_mode = tk.StringVar(value="Auto")
+    selected_memory_budget = tk.IntVar(value=DEFAULT_MEMORY_BUDGET_MB)
+    selected_extensions = tk.StringVar(value="dng")
+    include_subfolders = tk.BooleanVar(value=True)
+    watch_folder = tk.BooleanVar(value=False)
+    variables = {
+        "input_folder": input_folder_path,
+        "output_folder": output_folder_path,
+        "mpx": selected_mpx_option,
+        "resize_mode": selected_resize_mode,
+        "quality": selected_quality,
+        "max_size": selected_max_size,
+        "output_format": selected_output_format,
+        "subsampling": selected_subsampling,
+        "renditions": selected_renditions,
+        "workers": selected_workers,
+        "skip_converted": skip_converted,
+        "decode_mode": selected_decode_mode,
+        "memory_budget": selected_memory_budget,
+        "extensions": selected_extensions,
+        "include_subfolders": include_subfolders,
+        "watch": watch_folder,
+    }
+
+    # Input Folder Selection
+    input_frame = tk.LabelFrame(root, text="Input Folder (DNG files)")
+    input_frame.pack(padx=20, pady=10, fill="x")
+
+    input_entry = tk.Entry(input_frame, textvariable=input_folder_path, width=50)
+    input_entry.pack(side=tk.LEFT, padx=5, pady=5, expand=True, fill="x")
+
+    input_button = tk.Button(input_frame, text="Browse", 
+                             command=lambda: input_folder_path.set(filedialog.askdirectory()))
+    input_button.pack(side=tk.RIGHT, padx=5, pady=5)
+
+    # Output Folder Selection
+    output_frame = tk.LabelFrame(root, text="Output Folder")
+    output_frame.pack(padx=20, pady=10, fill="x")
+
+    output_entry = tk.Entry(output_frame, textvariable=output_folder_path, width=50)
+    output_entry.pack(side=tk.LEFT, padx=5, pady=5, expand=True, fill="x")
+
+    output_button = tk.Button(output_frame, text="Browse", 
+                              command=lambda: output_folder_path.set(filedialog.askdirectory()))
+    output_button.pack(side=tk.RIGHT, padx=5, pady=5)
+
+    # ตัวเลือกแบ่งเป็นสองแท็บ: ภาพปลายทาง และการรัน batch
+    options_notebook = ttk.Notebook(root)
+    options_notebook.pack(padx=20, pady=10, fill="x")
+
+    # Image Options Frame
+    options_frame = tk.Frame(options_notebook)
+    options_notebook.add(options_frame, text="Image Options")
+
+    # MPX Selection
+    mpx_label = tk.Label(options_frame, text="Output MPX:")
+    mpx_label.grid(row=0, column=0, padx=5, pady=5, sticky="w")
+    mpx_dropdown = ttk.Combobox(options_frame, textvariable=selected_mpx_option, 
+                                values=list(MPX_OPTIONS.keys()), state="readonly", width=15)
+    mpx_dropdown.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+
+    # วิธีย่อขนาดภาพ (คุณภาพ vs ความเร็ว) ใช้คู่กับ Output MPX
+    resize_label = tk.Label(options_frame, text="Resize Quality:")
+    resize_label.grid(row=1, column=0, padx=5, pady=5, sticky="w")
+    resize_dropdown = ttk.Combobox(options_frame, textvariable=selected_resize_mode,
+                                   values=list(RESIZE_MODES.keys()), state="readonly", width=15)
+    resize_dropdown.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
+
+    # JPG Quality Slider
+    quality_label = tk.Label(options_frame, text="JPG Quality (1-100):")
+    quality_label.grid(row=2, column=0, padx=5, pady=5, sticky="w")
+
+    # !!! การเปลี่ยนแปลงที่นี่ !!!
+    # เพิ่ม command=update_quality_value เพื่อให้เรียกฟังก์ชันนี้ทุกครั้งที่ Slider ถูกเลื่อน
+    quality_slider = ttk.Scale(options_frame, from_=1, to=100, orient="horizontal", 
+                               variable=selected_quality, length=200, 
+                               command=update_quality_value) # <--- เพิ่มบรรทัดนี้
+    quality_slider.grid(row=2, column=1, padx=5, pady=5, sticky="ew")
+
+    # เพิ่ม Label แสดงค่า Quality ปัจจุบัน (จะแสดงเป็น Integer อัตโนมัติเพราะผูกกับ tk.IntVar)
+    quality_value_label = tk.Label(options_frame, textvariable=selected_quality)
+    quality_value_label.grid(row=2, column=2, padx=5, pady=5, sticky="w")
+
+    # ขนาดไฟล์สูงสุด (KB หรือมีหน่วยเช่น 2MB, ว่าง/0 = ไม่จำกัด): ใช้คุณภาพสูงสุดที่ไม่เกิน JPG Quality ที่ได้ไฟล์ไม่เกินขนาดนี้
+    max_size_label = tk.Label(options_frame, text="Max File Size (KB):")
+    max_size_label.grid(row=3, column=0, padx=5, pady=5, sticky="w")
+    max_size_spinbox = tk.Spinbox(options_frame, from_=0, to=1_000_000, increment=100,
+                                  textvariable=selected_max_size, width=8)
+    max_size_spinbox.grid(row=3, column=1, padx=5, pady=5, sticky="w")
+
+    # รูปแบบไฟล์ปลายทาง (แสดงเฉพาะที่ encode ได้ในเครื่องนี้) และ chroma subsampling
+    format_label = tk.Label(options_frame, text="Output Format:")
+    format_label.grid(row=4, column=0, padx=5, pady=5, sticky="w")
+    format_dropdown = ttk.Combobox(options_frame, textvariable=selected_output_format,
+                                   values=available_output_formats(), state="readonly", width=15)
+    format_dropdown.grid(row=4, column=1, padx=5, pady=5, sticky="ew")
+
+    subsampling_label = tk.Label(options_frame, text="Chroma Subsampling:")
+    subsampling_label.grid(row=5, column=0, padx=5, pady=5, sticky="w")
+    subsampling_dropdown = ttk.Combobox(options_frame, textvariable=selected_subsampling,
+                                        values=list(CHROMA_SUBSAMPLINGS), state="readonly", width=15)
+    subsampling_dropdown.grid(row=5, column=1, padx=5, pady=5, sticky="ew")
+
+    # Renditions เพิ่มเติมจากการ decode ครั้งเดียว เช่น "Original:95::archive; 2 MPX:80:_web"
+    # (PRESET:QUALITY[:SUFFIX[:SUBFOLDER]] คั่นด้วย ;) ถ้าว่างจะใช้ Output MPX และ JPG Quality
+    renditions_label = tk.Label(options_frame, text="Renditions:")
+    renditions_label.grid(row=6, column=0, padx=5, pady=5, sticky="w")
+    renditions_entry = tk.Entry(options_frame, textvariable=selected_renditions, width=20)
+    renditions_entry.grid(row=6, column=1, columnspan=2, padx=5, pady=5, sticky="ew")
+
+    options_frame.grid_columnconfigure(1, weight=1) # ให้ Combobox และ Slider ขยายเต็มพื้นที่
+
+    # Batch Options Frame
+    batch_frame = tk.Frame(options_notebook)
+    options_notebook.add(batch_frame, text="Batch Options")
+
+    # Worker Processes
+    workers_label = tk.Label(batch_frame, text="Worker Processes:")
+    workers_label.grid(row=0, column=0, padx=5, pady=5, sticky="w")
+    workers_spinbox = tk.Spinbox(batch_frame, from_=1, to=DEFAULT_WORKERS, textvariable=selected_workers,
+                                 state="readonly", width=5)
+    workers_spinbox.grid(row=0, column=1, padx=5, pady=5, sticky="w")
+
+    # Decode Mode (คุณภาพ vs ความเร็ว)
+    decode_label = tk.Label(batch_frame, text="Decode Mode:")
+    decode_label.grid(row=1, column=0, padx=5, pady=5, sticky="w")
+    decode_dropdown = ttk.Combobox(batch_frame, textvariable=selected_decode_mode,
+                                   values=list(DECODE_MODES.keys()), state="readonly", width=15)
+    decode_dropdown.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
+
+    # Memory Budget (0 = ไม่จำกัด)
+    memory_label = tk.Label(batch_frame, text="Memory Budget (MB):")
+    memory_label.grid(row=2, column=0, padx=5, pady=5, sticky="w")
+    memory_spinbox = tk.Spinbox(batch_frame, from_=0, to=1_048_576, increment=512,
+                                textvariable=selected_memory_budget, width=8)
+    memory_spinbox.grid(row=2, column=1, padx=5, pady=5, sticky="w")
+
+    # นามสกุลไฟล์ raw ที่จะแปลง (คั่นด้วย , หรือเว้นวรรค)
+    extensions_label = tk.Label(batch_frame, text="File Types:")
+    extensions_label.grid(row=3, column=0, padx=5, pady=5, sticky="w")
+    extensions_entry = tk.Entry(batch_frame, textvariable=selected_extensions, width=20)
+    extensions_entry.grid(row=3, column=1, padx=5, pady=5, sticky="ew")
+
+    # รวมไฟล์ในโฟลเดอร์ย่อย (โครงสร้างโฟลเดอร์ถูกสร้างซ้ำในโฟลเดอร์ปลายทาง)
+    subfolders_checkbox = tk.Checkbutton(batch_frame, text="Include subfolders", variable=include_subfolders)
+    subfolders_checkbox.grid(row=4, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+
+    # ข้ามไฟล์ที่แปลงแล้ว (ตาม manifest ในโฟลเดอร์ปลายทาง)
+    skip_checkbox = tk.Checkbutton(batch_frame, text="Skip files already converted with the same settings",
+                                   variable=skip_converted)
+    skip_checkbox.grid(row=5, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+
+    # เฝ้าโฟลเดอร์ต้นฉบับต่อหลังแปลงไฟล์ที่มีอยู่เสร็จ แล้วแปลงไฟล์ใหม่ทันทีที่คัดลอกเสร็จ
+    watch_checkbox = tk.Checkbutton(batch_frame, text="Watch input folder and convert new files as they arrive",
+                                    variable=watch_folder)
+    watch_checkbox.grid(row=6, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+
+    batch_frame.grid_columnconfigure(1, weight=1)
+
+    # Start Conversion Button
+    start_button = tk.Button(root, text="Start Conversion", font=("Arial", 12, "bold"),
+                             command=lambda: start_conversion_thread(variables, progress_var, status_label,
+                                                                     throughput_label))
+    start_button.pack(pady=15)
+
+    # Progress Bar + ความเร็ว/เวลาที่เหลือ (แสดงระหว่างแปลงเท่านั้น)
+    progress_frame = tk.Frame(root)
+    progress_bar = ttk.Progressbar(progress_frame, variable=progress_var, maximum=100, length=400, mode='determinate')
+    progress_bar.pack()
+    throughput_label = tk.Label(progress_frame, text="", font=("Arial", 9))
+    throughput_label.pack()
+    cancel_button = tk.Button(progress_frame, text="Cancel") # "Stop Watching" ในโหมด watch
+
+    # Status Label
+    status_label = tk.Label(root, text="Ready to convert...", font=("Arial", 10))
+    status_label.pack(pady=5)
+
+    root.mainloop()
\ No newline at end of file
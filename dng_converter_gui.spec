@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    hiddenimports=['pillow_heif'], # import เมื่อเลือก HEIF เท่านั้น PyInstaller จึงหาไม่เจอเอง
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],